@@ -1,10 +1,10 @@
 # ========== 核心修复：指定Gradio本地临时目录，解决PermissionError权限问题 ==========
 import os
+import sys
 import tempfile
 
-# 临时文件存项目内的gradio_temp文件夹，避开系统权限目录，自动创建
-os.environ['GRADIO_TEMP_DIR'] = os.path.join(os.path.dirname(__file__), "gradio_temp")
-os.makedirs(os.environ['GRADIO_TEMP_DIR'], exist_ok=True)
+# 临时文件存项目内的gradio_temp文件夹，避开系统权限目录（启动服务时创建）
+os.environ['GRADIO_TEMP_DIR'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gradio_temp")
 # ==================================================================================
 
 # ===================== 前置补丁+依赖导入 =====================
@@ -13,23 +13,58 @@ import PIL.Image as Image
 if not hasattr(Image, 'ANTIALIAS'):
     Image.ANTIALIAS = Image.LANCZOS
 
-# 核心依赖（仅保留基础必用）
-import librosa
+# 核心依赖（仅保留轻量必用；gradio/librosa/moviepy在首次使用时才导入，冷启动快）
 import numpy as np
-import gradio as gr
 import shutil
 import uuid
-from moviepy.editor import ImageClip, AudioFileClip, CompositeVideoClip, concatenate_videoclips
+import functools
+import hashlib
+import re
+import json
+import logging
+import contextlib
+import bisect
+import copy
+import subprocess
+import threading
+import time
+import queue
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from collections import OrderedDict
 from PIL import ImageDraw, ImageFont
 
-# 确保项目内临时目录存在（自动创建）
-os.makedirs("temp_output", exist_ok=True)
-os.makedirs("temp_text", exist_ok=True)
-os.makedirs("temp_subtitles", exist_ok=True)
-os.makedirs("temp_audio", exist_ok=True)
+# 导入本模块时不允许提前加载的重量级依赖（冷启动检查用）
+HEAVY_MODULES = ("gradio", "librosa", "moviepy", "numba")
+# 项目内临时目录（首次写入时自动创建，退出服务时清理）
+# 图片解码缓存temp_slides、渲染结果/分段缓存temp_render_cache跨重启复用，不在此列：
+# 前者由临时文件配额/过期清理约束，后者由各自的容量上限按LRU淘汰
+TEMP_DIRS = ["temp_output", "temp_text", "temp_subtitles", "temp_audio", "gradio_temp"]
 
-# 全局变量（仅保留视频路径，极简）
-generated_video_path = None
+
+def ensure_dir(path):
+    """按需创建目录并返回路径"""
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class MVError(Exception):
+    """面向用户的错误（界面层转换为gr.Error显示）"""
+
+
+logger = logging.getLogger("mv_maker")
+
+
+# 渲染任务并发与排队上限（可用环境变量调整）
+MAX_RENDER_JOBS = int(os.environ.get("MV_MAX_RENDER_JOBS", "2"))
+MAX_RENDER_QUEUE = int(os.environ.get("MV_MAX_RENDER_QUEUE", "8"))
+# 渲染结果缓存的磁盘上限（MB），超出按最近最少使用淘汰
+RENDER_CACHE_MB = int(os.environ.get("MV_RENDER_CACHE_MB", "2048"))
+# 增量渲染分段缓存的磁盘上限（MB）
+RENDER_CHUNK_CACHE_MB = int(os.environ.get("MV_RENDER_CHUNK_CACHE_MB", "2048"))
+# 输出/临时文件的总容量上限（MB）、过期时间（小时）与后台清理间隔（秒）
+STORAGE_QUOTA_MB = int(os.environ.get("MV_STORAGE_MB", "4096"))
+STORAGE_TTL_HOURS = float(os.environ.get("MV_STORAGE_TTL_HOURS", "24"))
+STORAGE_SWEEP_SECONDS = float(os.environ.get("MV_STORAGE_SWEEP_SECONDS", "300"))
 
 
 # ===================== 核心工具函数（完全保留，功能不变） =====================
@@ -91,49 +126,352 @@ def parse_color(color_str):
     return (255, 255, 255)
 
 
-def detect_voice_segments(audio_path, threshold=0.02, min_duration=0.3):
-    """语音段检测（核心保留，你的12段语音正常检测）"""
-    if not os.path.exists(audio_path):
-        return "❌ 音频文件不存在，请重新上传！", []
-    y, sr = librosa.load(audio_path, sr=None)
-    frame_length = 2048
-    hop_length = 512
-    energy = librosa.feature.rms(y=y, frame_length=frame_length, hop_length=hop_length)[0]
-    times = librosa.times_like(energy, sr=sr, hop_length=hop_length)
-    voice_frames = energy > threshold
-    segments = []
-    start = None
-    for i, is_voice in enumerate(voice_frames):
-        if is_voice and start is None:
-            start = times[i]
-        elif not is_voice and start is not None:
-            end = times[i]
-            if end - start >= min_duration:
-                segments.append((round(start, 2), round(end, 2)))
-            start = None
-    if start is not None:
-        end = times[-1]
-        if end - start >= min_duration:
-            segments.append((round(start, 2), round(end, 2)))
-    # 合并相邻短语音段
-    final_segments = []
-    for seg in segments:
-        if not final_segments:
-            final_segments.append(seg)
-        else:
-            last_s, last_e = final_segments[-1]
-            if seg[0] - last_e < 0.2:
-                final_segments[-1] = (last_s, seg[1])
-            else:
-                final_segments.append(seg)
+def file_digest(path):
+    """文件内容哈希（按路径+大小+修改时间缓存，避免重复读盘）"""
+    st = os.stat(path)
+    return _file_digest(os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=1024)
+def _file_digest(path, size, mtime_ns):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class LRUCache:
+    """线程安全的LRU缓存（按条目字节数限制容量）"""
+
+    def __init__(self, max_bytes, sizeof=lambda value: 1):
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._data:
+                self._bytes -= self._sizeof(self._data.pop(key))
+            self._data[key] = value
+            self._bytes += self._sizeof(value)
+            # 淘汰最久未使用的条目（至少保留刚放入的一条）
+            while self._bytes > self.max_bytes and len(self._data) > 1:
+                _, old = self._data.popitem(last=False)
+                self._bytes -= self._sizeof(old)
+        return value
+
+
+def _probe_audio_codec(audio_path):
+    """用ffmpeg读取音频编码名（如aac/mp3），失败返回None"""
+    try:
+        proc = subprocess.run([_ffmpeg_exe(), "-hide_banner", "-i", audio_path],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except OSError:
+        return None
+    match = re.search(r"Audio:\s*([A-Za-z0-9_]+)", proc.stderr.decode("utf-8", "replace"))
+    return match.group(1).lower() if match else None
+
+
+def probe_audio_duration(audio_path):
+    """只读文件头取音频时长（秒）：soundfile → ffprobe → ffmpeg输出的Duration，都失败返回None（不解码）"""
+    try:
+        import soundfile as sf
+        return float(sf.info(audio_path).duration)
+    except Exception:
+        pass
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe:
+        try:
+            proc = subprocess.run([ffprobe, "-v", "error", "-show_entries", "format=duration",
+                                   "-of", "default=noprint_wrappers=1:nokey=1", audio_path],
+                                  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            return float(proc.stdout.decode("utf-8", "replace").strip())
+        except (OSError, ValueError):
+            pass
+    try:
+        proc = subprocess.run([_ffmpeg_exe(), "-hide_banner", "-i", audio_path],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except OSError:
+        return None
+    match = re.search(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)", proc.stderr.decode("utf-8", "replace"))
+    if not match:
+        return None
+    h, m, sec = match.groups()
+    return int(h) * 3600 + int(m) * 60 + float(sec)
+
+
+def _open_audio_stream(audio_path, block_size):
+    """流式解码音频，返回(采样率, 声道数, 编码名, 块迭代器)，每块为(样本数, 声道数)的float32数组"""
+    try:
+        import soundfile as sf
+        sf_desc = sf.SoundFile(audio_path)
+    except Exception:
+        sf_desc = None
+    if sf_desc is None:
+        # soundfile无法解码（如AAC/M4A）时回退librosa整段加载（与原逻辑的解码结果一致）
+        import librosa
+        y, sr = librosa.load(audio_path, sr=None, mono=False)
+        y = y[:, None] if y.ndim == 1 else y.T
+
+        def _blocks():
+            for i in range(0, len(y), block_size):
+                yield y[i:i + block_size]
+        return sr, y.shape[1], _probe_audio_codec(audio_path), _blocks()
+
+    def _blocks():
+        with sf_desc:
+            while True:
+                data = sf_desc.read(frames=block_size, dtype="float32", always_2d=True)
+                if len(data) == 0:
+                    break
+                yield data
+    return sf_desc.samplerate, sf_desc.channels, sf_desc.format.lower(), _blocks()
+
+
+def _to_mono(block):
+    """多声道取均值，与librosa.to_mono一致"""
+    return block[:, 0] if block.shape[1] == 1 else np.mean(block, axis=1)
+
+
+class RmsAccumulator:
+    """流式RMS包络：逐块喂入单声道样本，结果与librosa.feature.rms(center=True)逐帧一致"""
+
+    def __init__(self, frame_length=2048, hop_length=512):
+        self.frame_length = frame_length
+        self.hop_length = hop_length
+        self._buf = np.zeros(frame_length // 2, dtype=np.float32)  # center=True：首尾各补frame_length//2个0
+        self._total = 0
+        self._parts = []
+
+    def _rms(self, y):
+        import librosa
+        return librosa.feature.rms(y=y, frame_length=self.frame_length, hop_length=self.hop_length,
+                                   center=False)[0]
+
+    def feed(self, block):
+        self._total += len(block)
+        buf = np.concatenate([self._buf, block.astype(np.float32, copy=False)])
+        if len(buf) >= self.frame_length:
+            n = 1 + (len(buf) - self.frame_length) // self.hop_length
+            used = (n - 1) * self.hop_length + self.frame_length
+            self._parts.append(self._rms(buf[:used]))
+            buf = buf[n * self.hop_length:]
+        self._buf = buf
+
+    def finish(self):
+        """补尾部静音，输出剩余帧（总帧数 = 1 + 样本数 // hop_length）"""
+        buf = np.concatenate([self._buf, np.zeros(self.frame_length // 2, dtype=np.float32)])
+        remaining = 1 + self._total // self.hop_length - sum(len(p) for p in self._parts)
+        if remaining > 0:
+            used = (remaining - 1) * self.hop_length + self.frame_length
+            buf = np.pad(buf, (0, max(0, used - len(buf))))
+            self._parts.append(self._rms(buf[:used]))
+        return np.concatenate(self._parts) if self._parts else np.zeros(0, dtype=np.float32)
+
+
+# 流式解码的块大小（hop整数倍，约6秒@44.1kHz）
+AUDIO_BLOCK_SIZE = 512 * 512
+
+
+# ===================== 共享音频库：每个上传只解码一次，检测与渲染共用 =====================
+# 可直接流复制进MP4的音频编码（无需重新编码）
+MP4_AUDIO_CODECS = ("aac",)
+
+
+class AudioAsset:
+    """一次解码的产物：元信息 + RMS包络；渲染时ffmpeg直接读取原文件（AAC源流复制，其余编码为AAC）"""
+
+    def __init__(self, path, digest, sample_rate, channels, n_samples, codec, envelope):
+        self.path = path
+        self.digest = digest
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.n_samples = n_samples
+        self.codec = codec
+        self.envelope = envelope
+
+    @property
+    def duration(self):
+        return self.n_samples / float(self.sample_rate) if self.sample_rate else 0.0
+
+    @property
+    def can_copy(self):
+        return self.codec in MP4_AUDIO_CODECS
+
+    def ffmpeg_input(self):
+        """渲染时的ffmpeg音频输入参数与音频编码方式"""
+        return ["-i", self.path], "copy" if self.can_copy else "aac"
+
+
+class AudioStore:
+    """共享音频库：按内容哈希缓存解码结果，检测阈值调整、预览与渲染都不再重复解码
+    只保留元信息与包络，不落盘PCM：渲染时混流本就要经ffmpeg，由ffmpeg直接读原文件"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self._cache = LRUCache(max_bytes, sizeof=lambda asset: asset.envelope.nbytes)
+        self._lock = threading.Lock()
+        self._decode_locks = {}
+
+    def get(self, audio_path):
+        """获取音频解码结果（首次调用时流式解码一遍）；内容相同的其他文件共用结果，返回的path为本次传入的文件"""
+        digest = file_digest(audio_path)
+        asset = self._cache.get(digest)
+        if asset is None:
+            with self._lock:
+                decode_lock = self._decode_locks.setdefault(digest, threading.Lock())
+            with decode_lock:  # 同一音频并发请求只解码一次
+                asset = self._cache.get(digest)
+                if asset is None:
+                    asset = self._cache.put(digest, self._decode(audio_path, digest))
+            with self._lock:
+                self._decode_locks.pop(digest, None)
+        if asset.path != audio_path:
+            # 首次上传的文件可能已被清理，渲染读取本次传入的文件
+            asset = copy.copy(asset)
+            asset.path = audio_path
+        return asset
+
+    def add(self, asset):
+        """登记其他进程解码好的结果（如批量检测的进程池），之后检测/渲染直接复用"""
+        if self._cache.get(asset.digest) is None:
+            self._cache.put(asset.digest, asset)
+        return asset
+
+    def _decode(self, audio_path, digest):
+        """流式解码一遍：计算包络并统计采样数"""
+        sr, channels, codec, blocks = _open_audio_stream(audio_path, AUDIO_BLOCK_SIZE)
+        acc = RmsAccumulator()
+        n_samples = 0
+        for block in blocks:
+            acc.feed(_to_mono(block))
+            n_samples += len(block)
+        return AudioAsset(audio_path, digest, sr, channels, n_samples, codec, acc.finish())
+
+
+audio_store = AudioStore(max_bytes=int(os.environ.get("MV_ENVELOPE_CACHE_MB", "64")) * 1024 * 1024)
+
+
+def segments_from_envelope(energy, sr, threshold=0.02, min_duration=0.3, hop_length=512):
+    """由能量包络提取语音段（NumPy向量化：游程起止 → 时长过滤 → 相邻合并）"""
+    if len(energy) == 0:
+        return []
+    times = np.arange(len(energy)) * hop_length / float(sr)
+    voice = (energy > threshold).astype(np.int8)
+    edges = np.diff(np.concatenate(([0], voice, [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    # 持续到结尾的语音段以最后一帧时间为结束
+    end_times = times[np.minimum(ends, len(times) - 1)]
+    start_times = times[starts]
+    keep = end_times - start_times >= min_duration
+    start_times = np.round(start_times[keep], 2)
+    end_times = np.round(end_times[keep], 2)
+    if len(start_times) == 0:
+        return []
+    # 合并相邻短语音段：间隔<0.2秒的并入上一段
+    new_group = np.concatenate(([True], start_times[1:] - end_times[:-1] >= 0.2))
+    group_starts = np.flatnonzero(new_group)
+    group_ends = np.concatenate((group_starts[1:], [len(start_times)])) - 1
+    return list(zip(start_times[group_starts].tolist(), end_times[group_ends].tolist()))
+
+
+def format_voice_tip(final_segments):
+    """格式化检测结果文本"""
     if not final_segments:
-        return "❌ 未检测到语音，请调低阈值重试！", []
-    # 格式化检测结果
+        return "❌ 未检测到语音，请调低阈值重试！"
     tip = f"✅ 检测到{len(final_segments)}个语音段：\n"
     for i, (s, e) in enumerate(final_segments, 1):
         tip += f"{i}. {s}秒 → {e}秒（时长：{e - s:.2f}秒）\n"
     tip += "\n💡 请按语音段数输入对应行数的纯字幕！"
-    return tip, final_segments
+    return tip
+
+
+def get_rms_envelope(audio_path):
+    """获取音频RMS包络（共享音频库命中时不再解码），返回(包络, 采样率)"""
+    asset = audio_store.get(audio_path)
+    return asset.envelope, asset.sample_rate
+
+
+def detect_voice_segments(audio_path, threshold=0.02, min_duration=0.3):
+    """语音段检测（流式分块解码+向量化游程检测；同一音频只解码一次，改阈值毫秒级返回）"""
+    if not audio_path or not os.path.exists(audio_path):
+        return "❌ 音频文件不存在，请重新上传！", []
+    energy, sr = get_rms_envelope(audio_path)
+    final_segments = segments_from_envelope(energy, sr, threshold, min_duration)
+    return format_voice_tip(final_segments), final_segments
+
+
+def preview_thresholds(audio_path, thresholds=None, min_duration=0.3):
+    """多阈值预览：一次解码，列出各阈值下的语音段数，返回(提示文字, [(阈值, 段数)])"""
+    if not audio_path or not os.path.exists(audio_path):
+        return "❌ 音频文件不存在，请重新上传！", []
+    if thresholds is None:
+        thresholds = [round(0.01 * i, 2) for i in range(1, 11)]  # 与界面滑块范围一致
+    energy, sr = get_rms_envelope(audio_path)
+    counts = [(th, len(segments_from_envelope(energy, sr, th, min_duration))) for th in thresholds]
+    tip = "📈 不同阈值下的语音段数（按字幕行数选择对应阈值）：\n"
+    tip += "\n".join(f"阈值 {th:.2f} → {n}段" for th, n in counts)
+    return tip, counts
+
+
+def _detect_voice_task(audio_path, threshold=0.02, min_duration=0.3):
+    """批量检测的单个文件（进程池任务）：直接调用detect_voice_segments，并带回解码结果供主进程复用"""
+    t0 = time.perf_counter()
+    result = {"path": audio_path, "status": "failed", "segments": [], "tip": "", "error": None, "asset": None}
+    try:
+        result["tip"], result["segments"] = detect_voice_segments(audio_path, threshold, min_duration)
+        if audio_path and os.path.exists(audio_path):
+            result["status"] = "done"
+            result["asset"] = audio_store.get(audio_path)  # 刚解码过，直接命中
+        else:
+            result["error"] = result["tip"]
+    except Exception as e:
+        result["error"] = f"❌ 语音检测失败：{str(e) or type(e).__name__}"
+    result["seconds"] = round(time.perf_counter() - t0, 3)
+    return result
+
+
+def detect_voice_segments_batch(audio_paths, threshold=0.02, min_duration=0.3, workers=None):
+    """批量语音段检测：多个音频在进程池中并行解码+计算包络，每完成一个文件立即产出
+    {"index", "path", "status", "segments", "tip", "error", "seconds"}（按完成顺序，单个文件出错不影响其他文件）；
+    每个文件都调用detect_voice_segments，结果与逐个检测完全一致；解码结果登记到共享音频库，随后渲染不再解码"""
+    audio_paths = list(audio_paths)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(audio_paths)))
+
+    def finish(index, result):
+        asset = result.pop("asset")
+        if asset is not None:
+            audio_store.add(asset)
+        return {"index": index, **result}
+
+    if workers == 1:
+        for i, path in enumerate(audio_paths):
+            yield finish(i, _detect_voice_task(path, threshold, min_duration))
+        return
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = {pool.submit(_detect_voice_task, path, threshold, min_duration): i
+                   for i, path in enumerate(audio_paths)}
+        for fut in as_completed(futures):
+            i = futures[fut]
+            try:
+                result = fut.result()
+            except Exception as e:  # 子进程异常退出
+                result = {"path": audio_paths[i], "status": "failed", "segments": [], "tip": "",
+                          "error": f"❌ 语音检测进程异常退出：{e}", "asset": None, "seconds": None}
+            yield finish(i, result)
+    finally:
+        pool.shutdown(cancel_futures=True)  # 调用方提前停止读取时不再启动剩余任务
 
 
 def match_subtitle_with_voice(subtitle_text, voice_segments, start_offset=0.0, end_offset=0.0):
@@ -202,401 +540,3183 @@ def parse_subtitles(subtitle_text, video_w, video_h):
                 "pos_x_str": pos_x_str, "pos_y_str": pos_y_str
             })
         except Exception as e:
-            raise gr.Error(
+            raise MVError(
                 f"第{idx + 1}行字幕解析失败：{str(e)}\n✅ 正确格式：0.0,你好世界,3.0,36,#FFFFFF,center,bottom100")
     return subtitles
 
 
-def create_text_image(text, size, color, bg_color=(0, 0, 0, 0)):
-    """生成字幕/文字图片（核心保留，精准居中）"""
-    try:
-        # 兼容Windows/Mac/Linux字体
-        font_paths = [
-            "C:/Windows/Fonts/simhei.ttf",  # Windows黑体
-            "C:/Windows/Fonts/msyh.ttc",  # 微软雅黑
-            "/Library/Fonts/Arial.ttf",  # Mac
-            "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"  # Linux
-        ]
-        font = None
-        for font_path in font_paths:
-            if os.path.exists(font_path):
-                try:
-                    font = ImageFont.truetype(font_path, size)
-                    break
-                except:
-                    continue
-        if font is None:
-            font = ImageFont.load_default()
-        # 计算文字宽高（兼容新旧PIL）
-        dummy_img = Image.new('RGBA', (1, 1), bg_color)
-        draw = ImageDraw.Draw(dummy_img)
+# ===================== 字体注册表 + 文字贴图缓存（进程内复用，热路径不落盘） =====================
+# 兼容Windows/Mac/Linux字体（按顺序优先）
+FONT_PATHS = [
+    "C:/Windows/Fonts/simhei.ttf",  # Windows黑体
+    "C:/Windows/Fonts/msyh.ttc",  # 微软雅黑
+    "/Library/Fonts/Arial.ttf",  # Mac
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"  # Linux
+]
+
+
+@functools.lru_cache(maxsize=None)
+def _available_font_paths():
+    """探测本机存在的字体文件（仅首次调用访问磁盘）"""
+    return tuple(p for p in FONT_PATHS if os.path.exists(p))
+
+
+@functools.lru_cache(maxsize=64)
+def _load_truetype(font_path, size):
+    """按(路径, 字号)缓存已加载的字体对象"""
+    return ImageFont.truetype(font_path, size)
+
+
+def get_font(size):
+    """获取指定字号的字体（字体注册表，LRU缓存）"""
+    for font_path in _available_font_paths():
         try:
-            bbox = draw.textbbox((0, 0), text, font=font)
-            w, h = bbox[2] - bbox[0], bbox[3] - bbox[1]
-        except:
-            w, h = draw.textsize(text, font=font)
-        # 生成透明背景文字图片
-        img = Image.new('RGBA', (w, h), bg_color)
-        draw = ImageDraw.Draw(img)
-        draw.text((0, 0), text, font=font, fill=color)
-        temp_path = os.path.join("temp_text", f"text_{uuid.uuid4()}.png")
-        img.save(temp_path, format='PNG')
-        return temp_path, w, h
+            return _load_truetype(font_path, size)
+        except Exception:
+            continue
+    return ImageFont.load_default()
+
+
+@functools.lru_cache(maxsize=512)
+def _render_text_sprite(text, size, color, bg_color):
+    font = get_font(size)
+    # 计算文字宽高（兼容新旧PIL）
+    dummy_img = Image.new('RGBA', (1, 1), bg_color)
+    draw = ImageDraw.Draw(dummy_img)
+    try:
+        bbox = draw.textbbox((0, 0), text, font=font)
+        w, h = bbox[2] - bbox[0], bbox[3] - bbox[1]
+    except:
+        w, h = draw.textsize(text, font=font)
+    # 生成透明背景文字图片
+    img = Image.new('RGBA', (w, h), bg_color)
+    draw = ImageDraw.Draw(img)
+    draw.text((0, 0), text, font=font, fill=color)
+    sprite = np.asarray(img, dtype=np.uint8).copy()
+    sprite.flags.writeable = False  # 缓存共享，禁止修改
+    return sprite
+
+
+def create_text_sprite(text, size, color, bg_color=(0, 0, 0, 0)):
+    """生成字幕/文字RGBA数组（内存渲染，相同文字直接复用），返回(数组, 宽, 高)"""
+    try:
+        sprite = _render_text_sprite(text, int(size), tuple(color), tuple(bg_color))
+        return sprite, sprite.shape[1], sprite.shape[0]
     except Exception as e:
         raise Exception(f"文字生成失败：{str(e)}")
 
 
-def create_slideshow_clip(img_paths, duration, slide_duration=3.0):
-    """多张背景图轮播核心函数（完全保留，你的核心需求）"""
-    if len(img_paths) == 0:
-        raise Exception("❌ 请至少上传一张背景图！")
-    if len(img_paths) == 1:
-        # 单张图直接显示全程
-        return ImageClip(img_paths[0]).set_duration(duration)
+def create_text_image(text, size, color, bg_color=(0, 0, 0, 0)):
+    """生成字幕/文字图片文件（兼容旧接口，合成流程已改用create_text_sprite）"""
+    sprite, w, h = create_text_sprite(text, size, color, bg_color)
+    temp_path = os.path.join(ensure_dir("temp_text"), f"text_{uuid.uuid4()}.png")
+    Image.fromarray(sprite, 'RGBA').save(temp_path, format='PNG')
+    return temp_path, w, h
 
-    # 多张图自动均分时长，最后一张补全剩余时间，避免时长不匹配
-    num_imgs = len(img_paths)
+
+def slide_schedule(num_imgs, duration, slide_duration=3.0):
+    """轮播时间表：返回每张图的(开始, 结束)秒数（多图均分，最后一张补全剩余时长）"""
+    if num_imgs <= 1:
+        return [(0.0, duration)]
     base_duration = duration / num_imgs
-    clip_list = []
     remaining_duration = duration
-
-    for i, img_path in enumerate(img_paths):
+    schedule = []
+    t = 0.0
+    for i in range(num_imgs):
         if i == num_imgs - 1:
             img_dur = remaining_duration
         else:
             img_dur = min(base_duration, slide_duration)
             remaining_duration -= img_dur
+        schedule.append((t, t + img_dur))
+        t += img_dur
+    return schedule
+
 
-        img_clip = ImageClip(img_path).set_duration(img_dur)
-        clip_list.append(img_clip)
+def create_slideshow_clip(img_paths, duration, slide_duration=3.0):
+    """多张背景图轮播核心函数（MoviePy版本，合成流程已改用RenderPlan）"""
+    from moviepy.editor import ImageClip, concatenate_videoclips
+    if len(img_paths) == 0:
+        raise Exception("❌ 请至少上传一张背景图！")
+    if len(img_paths) == 1:
+        # 单张图直接显示全程
+        return ImageClip(img_paths[0]).set_duration(duration)
+
+    # 多张图自动均分时长，最后一张补全剩余时间，避免时长不匹配
+    clip_list = [ImageClip(img_path).set_duration(e - s)
+                 for img_path, (s, e) in zip(img_paths, slide_schedule(len(img_paths), duration, slide_duration))]
 
     # 拼接轮播剪辑，兼容不同尺寸图片
     slideshow_clip = concatenate_videoclips(clip_list, method="compose")
     return slideshow_clip
 
 
-def mp3_images_to_mp4(mp3_path, img_paths, slide_duration, text="", text_size=30, text_color="#FFFFFF",
-                      text_pos="center,80", watermark_path=None, watermark_alpha=0.5,
-                      watermark_pos="right20,bottom20", subtitle_text=""):
-    """核心合成：MP3+多张背景轮播+字幕+水印（你的核心需求）"""
-    global generated_video_path
-    temp_files = []
+# ===================== 渲染统计：分阶段耗时、帧率、峰值内存、临时写入量、可选cProfile =====================
+class RenderStats:
+    """单次渲染的分阶段统计（多进程分段渲染时各阶段为所有进程耗时之和）"""
+    STAGES = ("audio_load", "image_decode", "text_sprites", "composite", "frame_wait", "encode", "mux")
+
+    def __init__(self):
+        self.stages = {name: 0.0 for name in self.STAGES}
+        self.frames = 0
+        self.temp_bytes = 0
+        self.output_bytes = 0
+        self.wall_seconds = 0.0
+        self.profile_path = None
+        self.encoder = None  # 实际使用的编码档位（EncoderProfile.to_dict()）
+        self.chunks = None  # 增量渲染的分段复用情况
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """累计某阶段耗时"""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - t0)
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_temp_bytes(self, n_bytes):
+        with self._lock:
+            self.temp_bytes += n_bytes
+
+    def merge(self, other):
+        """合并子进程返回的统计（to_dict结果）"""
+        for name, seconds in other.get("stages", {}).items():
+            self.add_time(name, seconds)
+        self.add_temp_bytes(other.get("temp_bytes_written", 0))
+
+    def to_dict(self):
+        peak, child_peak = _peak_rss_mb()
+        return {
+            "stages": {name: round(sec, 4) for name, sec in self.stages.items()},
+            "wall_seconds": round(self.wall_seconds, 3),
+            "frames": self.frames,
+            "fps": round(self.frames / self.wall_seconds, 2) if self.wall_seconds > 0 else None,
+            "peak_rss_mb": peak, "child_peak_rss_mb": child_peak,
+            "temp_bytes_written": self.temp_bytes, "output_bytes": self.output_bytes,
+            "profile": self.profile_path,
+            "encoder": self.encoder, "speed": self._speed(), "chunks": self.chunks,
+        }
+
+    def _speed(self):
+        """编码速度：成片时长/实际耗时（倍速）"""
+        if not self.encoder or self.wall_seconds <= 0:
+            return None
+        return round(self.frames / self.encoder["fps"] / self.wall_seconds, 2)
+
+
+def _stage(stats, name):
+    """stats为None时不计时"""
+    return stats.stage(name) if stats is not None else contextlib.nullcontext()
+
+
+def _peak_rss_mb():
+    """本进程与已结束子进程（ffmpeg等）的峰值常驻内存（MB），无resource模块的平台（Windows）返回None"""
     try:
-        # 基础校验
-        if not os.path.exists(mp3_path):
-            raise Exception(f"❌ MP3文件不存在：{mp3_path}")
-        if not img_paths or len(img_paths) == 0:
-            raise Exception("❌ 请至少上传一张背景图！")
+        import resource
+    except ImportError:
+        return None, None
+    unit = 1 if sys.platform == "darwin" else 1024  # macOS单位为字节，Linux为KB
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 1024 / 1024
+    # Linux的ru_maxrss会继承父进程峰值，优先读取本进程地址空间自己的VmHWM
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    own = int(line.split()[1]) / 1024
+                    break
+    except OSError:
+        pass
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 1024 / 1024
+    return round(own, 1), round(children, 1)
 
-        # 加载音频，获取总时长
-        audio = AudioFileClip(mp3_path)
-        audio_duration = audio.duration
 
-        # 1. 创建背景轮播剪辑（核心功能，多张图自动切换）
-        bg_clip = create_slideshow_clip(img_paths, audio_duration, slide_duration)
-        vid_w, vid_h = bg_clip.size
-
-        # 2. 生成全局文字（全程显示）
-        main_text_clip = None
-        if text.strip():
-            rgb = parse_color(text_color)
-            text_img_path, text_w, text_h = create_text_image(text, text_size, rgb)
-            temp_files.append(text_img_path)
-            main_text_clip = ImageClip(text_img_path).set_duration(audio_duration)
-            tx_str, ty_str = text_pos.split(",") if "," in text_pos else (text_pos, "0")
-            tx = parse_pos(tx_str, vid_w, text_w, is_x=True)
-            ty = parse_pos(ty_str, vid_h, text_h, is_x=False)
-            main_text_clip = main_text_clip.set_position((tx, ty))
-
-        # 3. 生成水印（可选）
-        watermark_clip = None
-        if watermark_path and os.path.exists(watermark_path):
-            wm_img = Image.open(watermark_path)
-            w, h = wm_img.size
-            # 等比例缩放水印到高度80px
-            new_w = int(w * (80 / h))
-            new_h = 80
-            wm_img_resized = wm_img.resize((new_w, new_h),
-                                           Image.LANCZOS if hasattr(Image, 'LANCZOS') else Image.BILINEAR)
-            wm_temp = os.path.join("temp_subtitles", f"wm_{uuid.uuid4()}.png")
-            temp_files.append(wm_temp)
-            wm_img_resized.save(wm_temp)
-            # 生成水印剪辑
-            watermark_clip = ImageClip(wm_temp).set_opacity(watermark_alpha).set_duration(audio_duration)
-            wx_str, wy_str = watermark_pos.split(",") if "," in watermark_pos else (watermark_pos, "0")
-            wx = parse_pos(wx_str, vid_w, new_w, is_x=True)
-            wy = parse_pos(wy_str, vid_h, new_h, is_x=False)
-            watermark_clip = watermark_clip.set_position((wx, wy))
-
-        # 4. 生成精准字幕（时间轴防重叠，居中显示）
-        subtitle_clips = []
-        if subtitle_text.strip():
-            subtitles = parse_subtitles(subtitle_text, vid_w, vid_h)
-            for sub in subtitles:
-                if sub["end"] > audio_duration:
-                    sub["end"] = audio_duration
-                # 生成字幕图片
-                sub_img_path, sub_w, sub_h = create_text_image(sub["content"], sub["font_size"], sub["color"])
-                temp_files.append(sub_img_path)
-                # 生成字幕剪辑
-                sub_clip = ImageClip(sub_img_path).set_duration(sub["end"] - sub["start"])
-                sub_x = parse_pos(sub["pos_x_str"], vid_w, sub_w, is_x=True)
-                sub_y = parse_pos(sub["pos_y_str"], vid_h, sub_h, is_x=False)
-                sub_clip = sub_clip.set_position((sub_x, sub_y)).set_start(sub["start"])
-                subtitle_clips.append(sub_clip)
-
-        # 组合所有视频轨：背景轮播→全局文字→水印→字幕
-        all_clips = [bg_clip]
-        if main_text_clip:
-            all_clips.append(main_text_clip)
-        if watermark_clip:
-            all_clips.append(watermark_clip)
-        all_clips.extend(subtitle_clips)
-        final_clip = CompositeVideoClip(all_clips).set_audio(audio)
+# 同一进程同一时刻只能有一个cProfile生效（Python 3.12+重复启用抛ValueError）
+_profiler_lock = threading.Lock()
 
-        # 导出MP4视频（H264编码，兼容性强）
-        output_path = os.path.join("temp_output", f"mv_{uuid.uuid4()}.mp4")
-        final_clip.write_videofile(
-            output_path, codec="libx264", audio_codec="aac",
-            fps=15, threads=4, verbose=False, logger=None
-        )
 
-        # 清理临时文件，释放资源
-        audio.close()
-        final_clip.close()
-        for f in temp_files:
-            try:
-                os.remove(f)
-            except:
-                pass
-        generated_video_path = output_path
-        return output_path
-    except Exception as e:
-        # 异常时也清理临时文件
-        for f in temp_files:
-            try:
-                os.remove(f)
-            except:
-                pass
-        raise gr.Error(f"MV生成失败：{str(e)}")
+def _start_profiler():
+    """启动cProfile，已有任务在记录（或被其他分析工具占用）时返回None，本任务不记录
+    Python 3.12+的cProfile基于sys.monitoring，记录的是整个进程所有线程（含并发任务）的耗时"""
+    if not _profiler_lock.acquire(blocking=False):
+        logger.info("已有渲染任务在记录cProfile，本任务不记录")
+        return None
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        _profiler_lock.release()
+        logger.info("cProfile无法启用（%s），本任务不记录", e)
+        return None
+    return profiler
 
 
-def download_video():
-    """下载生成的MV"""
-    global generated_video_path
-    if generated_video_path and os.path.exists(generated_video_path):
-        return generated_video_path
-    else:
-        raise gr.Error("❌ 请先生成MV后再下载！")
+def _stop_profiler(profiler):
+    """停止cProfile并保存结果，返回.prof文件路径"""
+    try:
+        profiler.disable()
+        profile_path = os.path.join(ensure_dir("temp_output"), f"profile_{uuid.uuid4().hex}.prof")
+        profiler.dump_stats(profile_path)
+    finally:
+        _profiler_lock.release()
+    logger.info("cProfile结果已保存：%s（可用python -m pstats查看）", profile_path)
+    return profile_path
 
 
-# ===================== Gradio界面（3.0最早期版本兼容，无任何高版本组件） =====================
-# 极简CSS美化（适配低版本，仅保留基础好看的样式）
-custom_css = """
-/* 主按钮渐变美化 */
-.gradio-container .button-primary {
-    background: linear-gradient(135deg, #2a93b7 0%, #d94691 100%) !important;
-    border: none !important;
-    color: white !important;
-    font-weight: 600 !important;
-    border-radius: 6px !important;
-}
-/* 按钮hover效果 */
-.gradio-container .button-primary:hover {
-    opacity: 0.9 !important;
-    box-shadow: 0 3px 8px rgba(0,0,0,0.1) !important;
-}
-/* 所有输入框圆角 */
-.gradio-container input, .gradio-container textarea, .gradio-container .slider {
-    border-radius: 6px !important;
-    border: 1px solid #e2e8f0 !important;
-}
-/* 标题文字美化 */
-.gradio-container h1 {
-    color: #2a93b7 !important;
-    font-weight: 700 !important;
-    text-align: center !important;
-    margin-bottom: 20px !important;
-}
-.gradio-container h2, .gradio-container h3 {
-    color: #334155 !important;
-    font-weight: 600 !important;
-    margin-top: 15px !important;
-}
-/* 整体容器内边距 */
-.gradio-container {
-    padding: 20px !important;
+# ===================== 渲染引擎：静态层预合成 + 字幕逐帧混合 + 原始帧直通编码器 =====================
+_scratch_buffers = threading.local()
+
+
+def _scratch(name, shape, dtype):
+    """当前线程按用途复用的临时缓冲区（容量只增不减），逐帧混合不再每次分配整帧临时数组
+    每个合成线程/进程各有一份，返回的数组在同一线程下次取同名缓冲区前有效"""
+    size = int(np.prod(shape))
+    buf = getattr(_scratch_buffers, name, None)
+    if buf is None or buf.dtype != dtype or buf.size < size:
+        buf = np.empty(size, dtype=dtype)
+        setattr(_scratch_buffers, name, buf)
+    return buf[:size].reshape(shape)
+
+
+class Overlay:
+    """叠加层：预乘alpha并裁剪到画布内，逐帧混合只做一次乘加"""
+
+    def __init__(self, pixels, x, y, canvas_size, opacity=1.0):
+        pixels = np.asarray(pixels)
+        canvas_w, canvas_h = canvas_size
+        x, y = int(x), int(y)  # 与MoviePy一致：位置向零取整
+        h, w = pixels.shape[:2]
+        # 与画布求交，超出画布的部分直接裁掉
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, canvas_w), min(y + h, canvas_h)
+        self.box = (x0, y0, x1, y1)
+        self.empty = x1 <= x0 or y1 <= y0
+        self._fingerprint = None
+        if self.empty:
+            return
+        self._region = np.ascontiguousarray(pixels[y0 - y:y1 - y, x0 - x:x1 - x], dtype=np.uint8)
+        self._opacity = opacity
+        self._premultiply()
+
+    def _premultiply(self):
+        region = self._region
+        if region.shape[2] == 4:
+            alpha = region[:, :, 3:4].astype(np.float32) / 255.0
+        else:
+            alpha = np.ones(region.shape[:2] + (1,), dtype=np.float32)
+        alpha *= self._opacity
+        self.inv_alpha = 1.0 - alpha
+        self.premul = region[:, :, :3].astype(np.float32) * alpha + 0.5  # +0.5用于四舍五入
+
+    def __getstate__(self):
+        # 跨进程只传uint8贴图（float预乘图是其4倍大），接收端重新预乘，结果逐位一致
+        state = dict(self.__dict__)
+        state.pop("inv_alpha", None)
+        state.pop("premul", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if not self.empty:
+            self._premultiply()
+
+    @property
+    def fingerprint(self):
+        """内容指纹（位置+预乘像素），增量渲染据此判断画面是否变化"""
+        if self._fingerprint is None:
+            digest = hashlib.sha1(repr(self.box).encode("utf-8"))
+            if not self.empty:
+                digest.update(self.premul.tobytes())
+                digest.update(self.inv_alpha.tobytes())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def blend_into(self, frame):
+        """原地混合到uint8画布"""
+        if self.empty:
+            return
+        x0, y0, x1, y1 = self.box
+        dst = frame[y0:y1, x0:x1]
+        mixed = _scratch("overlay", dst.shape, np.float32)
+        np.copyto(mixed, dst)
+        np.multiply(mixed, self.inv_alpha, out=mixed)
+        np.add(mixed, self.premul, out=mixed)
+        np.copyto(dst, mixed, casting="unsafe")
+
+
+# 输出画布预设（auto=按图片最大宽高，与旧版一致）
+CANVAS_PRESETS = {
+    "auto": None,
+    "1080x1920": (1080, 1920),  # 竖屏短视频
+    "1920x1080": (1920, 1080),  # 横屏
+    "1080x1080": (1080, 1080),  # 方形
 }
-"""
 
-# 构建基础界面（仅用Tabs/Row/Column/基础组件，无任何高级组件）
-with gr.Blocks(title="🎤 AI翻唱MV生成器（轮播版）", css=custom_css) as demo:
-    # 顶部主标题
-    gr.Markdown("# 🎤 AI翻唱MV生成器（多张背景轮播版）")
-    gr.Markdown("### ✨ 核心功能：多张背景图轮播 | 字幕精准居中 | 语音段自动检测 | 时间轴防重叠")
-    gr.Markdown("---")  # 用markdown横线替代Divider，兼容低版本
-
-    # 隐藏状态变量：存储语音段（替代全局变量，防止数据叠加）
-    voice_segments_state = gr.State(value=[])
-
-    # 标签页（仅用基础TabItem，无icon）
-    with gr.Tabs():
-        # 标签1：音频上传与语音检测
-        with gr.TabItem("音频语音检测"):
-            gr.Markdown("## 🎵 上传MP3音频并检测语音段")
-            mp3_input = gr.Audio(label="上传翻唱MP3音频", type="filepath")
-            detect_threshold = gr.Slider(
-                label="语音检测阈值（越小越灵敏，杂音多调至0.03-0.04）",
-                minimum=0.01, maximum=0.1, value=0.02, step=0.01
-            )
-            detect_btn = gr.Button("🔍 开始检测语音段", variant="primary")
-            voice_result = gr.Textbox(
-                label="语音检测结果", lines=6,
-                placeholder="检测结果将显示在这里，会列出所有语音段的起止时间..."
-            )
-            gr.Markdown("---")
-
-        # 标签2：字幕输入与时间轴匹配
-        with gr.TabItem("字幕时间轴生成"):
-            gr.Markdown("## ✏️ 输入纯字幕并匹配语音时间轴")
-            pure_subtitle = gr.Textbox(
-                label="纯字幕文本（每行一段，行数与语音段数一致，无时间）",
-                lines=8,
-                placeholder="示例：\n生活就像一杯清茶\n初入口时或许有些苦涩\n但细细品味\n却能感受到其中的甘甜与清香"
-            )
-            gr.Markdown("### ⏱️ 字幕时间全局偏移")
-            with gr.Row():
-                global_start_offset = gr.Slider(
-                    label="开始偏移（±秒）：负数=提前显示，正数=延后显示",
-                    minimum=-1.0, maximum=1.0, value=0.0, step=0.1
-                )
-                global_end_offset = gr.Slider(
-                    label="结束偏移（±秒）：负数=提前隐藏，正数=延后隐藏",
-                    minimum=-1.0, maximum=1.0, value=0.0, step=0.1
-                )
-            match_btn = gr.Button("⚡ 一键匹配语音时间轴", variant="primary")
-            matched_subtitle = gr.Textbox(
-                label="匹配后的带时间轴字幕（可手动微调）", lines=10,
-                placeholder="匹配后将生成标准格式：开始时间,内容,结束时间,字号,颜色,水平位置,垂直位置..."
-            )
-            gr.Markdown("---")
-
-        # 标签3：核心功能 - 多张背景轮播 + MV生成/下载
-        with gr.TabItem("MV生成与导出"):
-            with gr.Row():
-                # 左侧：配置区（轮播/文字/水印）
-                with gr.Column(scale=2):
-                    # 背景轮播核心配置（你的核心需求）
-                    gr.Markdown("## 🖼️ 多张背景图轮播设置")
-                    bg_imgs = gr.File(
-                        label="上传多张背景图（支持批量选择，JPG/PNG均可）",
-                        file_count="multiple", file_types=["image"]
-                    )
-                    slide_duration = gr.Slider(
-                        label="单张图片显示时长（秒），图片多建议设1-2秒",
-                        minimum=1.0, maximum=10.0, value=3.0, step=0.5
-                    )
-                    gr.Markdown("---")
-
-                    # 全局文字配置
-                    gr.Markdown("## 📜 全局文字（视频全程显示）")
-                    global_text = gr.Textbox(label="文字内容", placeholder="AI翻唱MV | 轮播版 | 字幕精准居中")
-                    global_text_size = gr.Slider(label="文字大小", minimum=10, maximum=100, value=30, step=1)
-                    global_text_color = gr.ColorPicker(label="文字颜色", value="#FFFFFF")
-                    global_text_pos = gr.Textbox(
-                        label="文字位置（示例：center,80 水平居中+距上80px | right20,bottom50 右下20px）",
-                        value="center,80"
-                    )
-                    gr.Markdown("---")
-
-                    # 水印配置（可选）
-                    gr.Markdown("## 🔖 水印设置（可选，建议PNG透明背景）")
-                    watermark_img = gr.Image(label="上传水印图片", type="filepath")
-                    wm_alpha = gr.Slider(label="水印透明度", minimum=0.1, maximum=1.0, value=0.5, step=0.1)
-                    wm_pos = gr.Textbox(label="水印位置（示例：right20,bottom20）", value="right20,bottom20")
-                    gr.Markdown("---")
-
-                    # 操作按钮
-                    with gr.Row():
-                        generate_btn = gr.Button("🚀 生成MV", variant="primary")
-                        download_btn = gr.Button("📥 下载MV")
-
-                # 右侧：字幕微调 + 预览下载
-                with gr.Column(scale=3):
-                    gr.Markdown("## 🎯 最终字幕配置（可手动修改时间/样式）")
-                    final_subtitle = gr.Textbox(
-                        label="最终字幕（匹配后自动同步，可手动改）",
-                        lines=12, value=""
-                    )
-                    gr.Markdown("---")
-                    gr.Markdown("## 🎥 MV预览与下载")
-                    video_output = gr.Video(label="生成的MV（轮播背景+精准字幕）", height=400)
-                    download_output = gr.File(label="下载的MP4视频文件")
-
-    # ===================== 绑定所有交互事件（基础绑定，兼容低版本） =====================
-    # 检测语音段
-    detect_btn.click(
-        fn=detect_voice_segments,
-        inputs=[mp3_input, detect_threshold],
-        outputs=[voice_result, voice_segments_state]
-    )
-    # 匹配字幕时间轴
-    match_btn.click(
-        fn=match_subtitle_with_voice,
-        inputs=[pure_subtitle, voice_segments_state, global_start_offset, global_end_offset],
-        outputs=matched_subtitle
-    )
-    # 匹配后的字幕自动同步到最终字幕框
-    matched_subtitle.change(
-        fn=lambda x: x,
-        inputs=matched_subtitle,
-        outputs=final_subtitle
-    )
-    # 生成MV（核心：传入多张背景图+轮播时长）
-    generate_btn.click(
-        fn=mp3_images_to_mp4,
-        inputs=[mp3_input, bg_imgs, slide_duration, global_text, global_text_size, global_text_color,
-                global_text_pos, watermark_img, wm_alpha, wm_pos, final_subtitle],
-        outputs=video_output
-    )
-    # 下载MV
-    download_btn.click(
-        fn=download_video,
-        inputs=[],
-        outputs=download_output
-    )
 
-# ===================== 启动应用 + 自动清理 + 依赖安装 =====================
-if __name__ == "__main__":
-    # 自动安装缺失依赖（清华源加速，解决下载慢/失败）
-    required_pkgs = ["gradio", "moviepy", "pillow", "librosa", "numpy"]
-    for pkg in required_pkgs:
-        try:
-            __import__(pkg)
-        except ImportError:
-            print(f"正在安装缺失依赖：{pkg}")
-            os.system(f"pip install {pkg} -i https://pypi.tuna.tsinghua.edu.cn/simple")
+def parse_canvas(canvas):
+    """解析画布尺寸：auto/None/"宽x高"/(宽, 高)，auto返回None"""
+    if canvas is None or isinstance(canvas, (tuple, list)):
+        return tuple(canvas) if canvas else None
+    canvas = str(canvas).strip().lower()
+    if canvas in CANVAS_PRESETS:
+        return CANVAS_PRESETS[canvas]
+    try:
+        w, h = (int(v) for v in canvas.replace("*", "x").split("x"))
+    except ValueError:
+        raise Exception(f"❌ 画布尺寸格式错误：{canvas}（示例：1080x1920）")
+    # 宽高取偶数，满足yuv420p编码要求
+    return max(2, w - w % 2), max(2, h - h % 2)
 
-    # 启动Gradio服务（本地访问，端口7860）
-    print("✅ 服务启动成功，浏览器访问：http://localhost:7860")
-    demo.launch(
-        server_name="0.0.0.0",
-        server_port=7860,
-        share=False  # 关闭公网分享，仅本地使用
-    )
 
+def _decode_background(img_path, canvas_size, fit, scale=1.0):
+    """解码背景图并居中铺到黑色画布；fit=True时等比缩放到画布内，否则按scale缩放（草稿预览，JPEG按缩小比例直接解码）"""
+    canvas_w, canvas_h = canvas_size
+    with Image.open(img_path) as img:
+        ratio = min(canvas_w / img.width, canvas_h / img.height) if fit else scale
+        resize = ratio != 1.0
+        if resize:
+            target = (max(1, round(img.width * ratio)), max(1, round(img.height * ratio)))
+            img.draft("RGB", target)  # JPEG：解码阶段即按1/2、1/4、1/8缩小，4800万像素也不会整图解码
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        img = img.convert("RGBA" if has_alpha else "RGB")
+        if resize and img.size != target:
+            img = img.resize(target, Image.LANCZOS, reducing_gap=3.0)
+        canvas = Image.new("RGB", (canvas_w, canvas_h), (0, 0, 0))
+        pos = (int((canvas_w - img.width) / 2), int((canvas_h - img.height) / 2))
+        canvas.paste(img, pos, mask=img if has_alpha else None)
+    return np.asarray(canvas, dtype=np.uint8)
 
-    # 程序退出时自动清理所有临时文件，避免占用磁盘
-    def cleanup_temp_files():
-        for dir_name in ["temp_output", "temp_text", "temp_subtitles", "temp_audio", "gradio_temp"]:
-            if os.path.exists(dir_name):
-                try:
-                    shutil.rmtree(dir_name)
-                    print(f"✅ 已清理临时目录：{dir_name}")
-                except Exception as e:
-                    print(f"⚠️  清理临时目录失败：{e}")
+
+def load_background(img_path, canvas_size, fit=False, stats=None, scale=1.0):
+    """背景图居中铺到黑色画布（与concatenate_videoclips(method="compose")一致）
+    解码结果按内容哈希缓存到temp_slides，重复上传的图片不再解码"""
+    mode = "fit" if fit else ("center" if scale == 1.0 else f"center{scale:g}")
+    cache_path = os.path.join(ensure_dir("temp_slides"), f"{file_digest(img_path)}_{canvas_size[0]}x{canvas_size[1]}_{mode}.npy")
+    try:
+        return np.load(cache_path)
+    except (OSError, ValueError):
+        pass
+    frame = _decode_background(img_path, canvas_size, fit, scale)
+    try:
+        tmp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, frame)
+        os.replace(tmp_path, cache_path)  # 原子替换，并发渲染不会读到半截文件
+        if stats is not None:
+            stats.add_temp_bytes(os.path.getsize(cache_path))
+    except OSError:
+        pass
+    return np.array(frame)
 
 
-    import atexit
+def load_watermark(watermark_path, height=80):
+    """读取水印并等比例缩放到指定高度，返回RGB/RGBA数组"""
+    with Image.open(watermark_path) as wm_img:
+        has_alpha = wm_img.mode in ("RGBA", "LA") or (wm_img.mode == "P" and "transparency" in wm_img.info)
+        wm_img = wm_img.convert("RGBA" if has_alpha else "RGB")
+        w, h = wm_img.size
+        new_w = int(w * (height / h))
+        wm_img = wm_img.resize((new_w, height), Image.LANCZOS if hasattr(Image, 'LANCZOS') else Image.BILINEAR)
+    return np.asarray(wm_img, dtype=np.uint8)
+
+
+def _split_pos(pos_str):
+    """拆分"x,y"位置字符串"""
+    return pos_str.split(",") if "," in pos_str else (pos_str, "0")
+
+
+class IntervalIndex:
+    """区间索引：按所有端点切成基本区间并预存各区间内生效的条目，查询一次二分O(log N)，与条目总数无关"""
+
+    def __init__(self, intervals):
+        # intervals：[(开始, 结束, 条目)]，左闭右开，生效条目保持原绘制顺序
+        starts_at, ends_at = {}, {}
+        for i, (s, e, _) in enumerate(intervals):
+            if e <= s:
+                continue
+            starts_at.setdefault(s, []).append(i)
+            ends_at.setdefault(e, []).append(i)
+        self.points = sorted(set(starts_at) | set(ends_at))
+        self._active = [()]  # _active[k]：已越过前k个端点时生效的条目
+        active = set()
+        for p in self.points:
+            active.difference_update(ends_at.get(p, ()))
+            active.update(starts_at.get(p, ()))
+            self._active.append(tuple(intervals[i][2] for i in sorted(active)))
+
+    def query(self, t):
+        """t时刻生效的条目"""
+        return self._active[bisect.bisect_right(self.points, t)]
+
+
+# 轮播转场效果（只在切换点前的转场窗口内逐帧计算，其余时间与硬切一样直接复用静态底图）
+TRANSITIONS = {"none": "硬切", "crossfade": "淡入淡出", "slide": "推移", "zoom": "缩放推近+淡出"}
+# 缩放转场结束时的放大倍数与水平平移比例
+ZOOM_END_SCALE = 1.2
+ZOOM_PAN = 0.05
+
+
+def _first_frame_at(t, fps):
+    """第一个时刻不早于t的帧序号（与帧时刻i/fps的浮点判定一致）"""
+    i = int(np.ceil(t * fps))
+    while i > 0 and (i - 1) / fps >= t:
+        i -= 1
+    while i / fps < t:
+        i += 1
+    return i
+
+
+def _crossfade(a, b, p, out=None):
+    """整数定点混合：a×(1-p) + b×p（out非空时写入out）"""
+    w = int(round(p * 256))
+    mixed = _scratch("crossfade_a", a.shape, np.uint16)
+    term = _scratch("crossfade_b", b.shape, np.uint16)
+    np.multiply(a, 256 - w, out=mixed, dtype=np.uint16)
+    np.multiply(b, w, out=term, dtype=np.uint16)
+    np.add(mixed, term, out=mixed)
+    np.right_shift(mixed, 8, out=mixed)
+    out = np.empty(a.shape, dtype=np.uint8) if out is None else out
+    np.copyto(out, mixed, casting="unsafe")
+    return out
+
+
+@functools.lru_cache(maxsize=256)
+def _zoom_maps(h, w, p):
+    """缩放+平移的行列采样表（按转场进度预计算并复用，逐帧只做一次查表取样）"""
+    scale = 1.0 + (ZOOM_END_SCALE - 1.0) * p
+    pan = ZOOM_PAN * w * p
+    rows = ((np.arange(h) + 0.5 - h / 2) / scale + h / 2).astype(np.intp)
+    cols = ((np.arange(w) + 0.5 - w / 2) / scale + w / 2 + pan).astype(np.intp)
+    rows = np.clip(rows, 0, h - 1)
+    cols = np.clip(cols, 0, w - 1)
+    rows.flags.writeable = cols.flags.writeable = False
+    return rows, cols
+
+
+def blend_transition(kind, a, b, p, out=None):
+    """转场画面：a为前一张、b为后一张的背景，p∈(0,1)为转场进度（out非空时写入out）"""
+    if kind == "slide":
+        w = a.shape[1]
+        offset = int(round(w * p))
+        out = np.empty_like(a) if out is None else out
+        out[:, :w - offset] = a[:, offset:]
+        out[:, w - offset:] = b[:, :offset]
+        return out
+    if kind == "zoom":
+        rows, cols = _zoom_maps(a.shape[0], a.shape[1], round(p, 4))
+        # 先取行再取列，都写入线程内复用的缓冲区
+        picked_rows = np.take(a, rows, axis=0, out=_scratch("zoom_rows", a.shape, a.dtype), mode="clip")
+        zoomed = np.take(picked_rows, cols, axis=1, out=_scratch("zoom", a.shape, a.dtype), mode="clip")
+        return _crossfade(zoomed, b, p, out)
+    return _crossfade(a, b, p, out)
+
+
+class RenderPlan:
+    """渲染计划：每张轮播图与全局文字/水印只预合成一次，逐帧仅混合当前生效的字幕"""
+
+    def __init__(self, canvas_size, duration, fps, slides, static_layers, subtitles, fit_slides=False,
+                 slide_scale=1.0, transition="none", transition_duration=0.5):
+        self.size = canvas_size  # (宽, 高)
+        self.fit_slides = fit_slides  # True：背景图等比缩放到画布；False：原尺寸居中
+        self.slide_scale = slide_scale  # 原尺寸居中时背景图的缩放比例（草稿预览<1）
+        self.duration = duration
+        self.fps = fps
+        self.slides = slides  # [(开始, 结束, 图片路径)]
+        self.static_layers = static_layers  # [Overlay]，按绘制顺序
+        self.subtitles = subtitles  # [(开始, 结束, Overlay)]
+        self._slide_starts = [s for s, _, _ in slides]
+        self._subtitle_index = IntervalIndex(subtitles)
+        self._base_cache = OrderedDict()
+        self._background_cache = OrderedDict()
+        self.transition = transition
+        self.transitions = self._transition_windows(transition_duration)  # [(起始帧, 结束帧, 后一张图序号)]
+        self._transition_starts = [start for start, _, _ in self.transitions]
+        self.stats = None  # RenderStats，可选
+
+    @property
+    def n_frames(self):
+        """总帧数（与MoviePy iter_frames一致：int(时长×fps)）"""
+        return int(self.duration * self.fps)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_base_cache"] = OrderedDict()  # 跨进程传递时不携带帧缓存与统计
+        state["_background_cache"] = OrderedDict()
+        state["stats"] = None
+        return state
+
+    def for_frames(self, start_frame, end_frame):
+        """只含[start_frame, end_frame)内生效字幕的计划副本（分段渲染跨进程时只传该段需要的叠加层，段内画面不变）"""
+        t0, t1 = start_frame / self.fps, end_frame / self.fps
+        part = copy.copy(self)
+        part.subtitles = [(s, e, layer) for s, e, layer in self.subtitles if s < t1 and e > t0]
+        part._subtitle_index = IntervalIndex(part.subtitles)
+        return part
+
+    def slide_index_at(self, t):
+        """t时刻显示的轮播图序号（切换点处显示后一张）"""
+        return max(0, bisect.bisect_right(self._slide_starts, t) - 1)
+
+    def _transition_windows(self, duration):
+        """转场窗口：每个切换点之前的round(duration×fps)帧（不超过前一张图显示时长的一半）"""
+        if self.transition == "none" or duration <= 0:
+            return []
+        windows = []
+        for idx in range(1, len(self.slides)):
+            switch = self.slides[idx][0]
+            end = _first_frame_at(switch, self.fps)
+            n = min(int(round(duration * self.fps)), int((switch - self.slides[idx - 1][0]) * self.fps / 2))
+            if n > 0 and end <= self.n_frames:
+                windows.append((end - n, end, idx))
+        return windows
+
+    def transition_at(self, t):
+        """t时刻所在的转场窗口与窗口内帧序号，不在转场中返回None"""
+        if not self.transitions:
+            return None
+        i = int(t * self.fps + 1e-6)
+        j = bisect.bisect_right(self._transition_starts, i) - 1
+        if j < 0 or i >= self.transitions[j][1]:
+            return None
+        return self.transitions[j], i - self.transitions[j][0]
+
+    def background(self, idx):
+        """轮播图背景（不含文字/水印），按轮播图缓存最近2张"""
+        frame = self._background_cache.get(idx)
+        if frame is not None:
+            self._background_cache.move_to_end(idx)
+            return frame
+        with _stage(self.stats, "image_decode"):
+            frame = load_background(self.slides[idx][2], self.size, self.fit_slides, self.stats, self.slide_scale)
+        frame.flags.writeable = False
+        self._background_cache[idx] = frame
+        while len(self._background_cache) > 2:
+            self._background_cache.popitem(last=False)
+        return frame
+
+    def base_frame(self, idx):
+        """静态底图：背景+全局文字+水印，按轮播图缓存（仅保留最近2张，内存有界）"""
+        frame = self._base_cache.get(idx)
+        if frame is not None:
+            self._base_cache.move_to_end(idx)
+            return frame
+        frame = np.array(self.background(idx))
+        with _stage(self.stats, "composite"):
+            for layer in self.static_layers:
+                layer.blend_into(frame)
+        frame.flags.writeable = False
+        self._base_cache[idx] = frame
+        while len(self._base_cache) > 2:
+            self._base_cache.popitem(last=False)
+        return frame
+
+    def active_subtitles(self, t):
+        """t时刻生效的字幕叠加层（区间左闭右开，与MoviePy一致；区间索引查询，与字幕总数无关）"""
+        return self._subtitle_index.query(t)
+
+    def change_points(self):
+        """时间轴变化点：轮播切换时刻 + 字幕开始/结束时刻 + 转场窗口内各帧时刻（升序去重）"""
+        points = {s for s, _, _ in self.slides[1:]}
+        points.update(self._subtitle_index.points)
+        # 转场窗口内每帧画面都不同，逐帧作为变化点
+        for start, end, _ in self.transitions:
+            points.update(i / self.fps for i in range(start, end))
+        return sorted(t for t in points if 0.0 < t < self.duration)
+
+    def frame_runs(self, start_frame=0, end_frame=None):
+        """把帧序号按画面状态分组，返回[(起始帧, 连续帧数)]，同组帧画面完全相同"""
+        end_frame = self.n_frames if end_frame is None else end_frame
+        if end_frame <= start_frame:
+            return []
+        times = np.arange(start_frame, end_frame) / self.fps
+        # 变化点区间左闭右开，与slide_index_at/active_subtitles的判定一致
+        states = np.searchsorted(np.asarray(self.change_points(), dtype=np.float64), times, side="right")
+        run_starts = np.flatnonzero(np.concatenate(([True], states[1:] != states[:-1])))
+        run_lengths = np.diff(np.concatenate((run_starts, [len(states)])))
+        return [(start_frame + int(i), int(n)) for i, n in zip(run_starts, run_lengths)]
+
+    def chunk_inputs(self, start_frame, end_frame):
+        """分段输入清单：段内每组相同画面的(相对起始帧, 帧数, 背景图哈希, 字幕指纹)，清单相同则逐帧画面相同"""
+        runs = []
+        for first, count in self.frame_runs(start_frame, end_frame):
+            t = first / self.fps
+            transition = self.transition_at(t)
+            if transition is not None:
+                (start, end, idx), k = transition
+                transition = [self.transition, k, end - start, file_digest(self.slides[idx][2])]
+            runs.append([first - start_frame, count, file_digest(self.slides[self.slide_index_at(t)][2]),
+                         [layer.fingerprint for layer in self.active_subtitles(t)], transition])
+        return {"size": list(self.size), "fps": self.fps, "fit": self.fit_slides, "scale": self.slide_scale,
+                "static": [layer.fingerprint for layer in self.static_layers], "runs": runs}
+
+    def transition_frame(self, window, k, out=None):
+        """转场窗口内第k帧的底图：前后两张背景按进度混合后再叠加文字/水印（文字水印不随转场移动）"""
+        start, end, idx = window
+        progress = (k + 1) / (end - start + 1)
+        a, b = self.background(idx - 1), self.background(idx)
+        with _stage(self.stats, "composite"):
+            frame = blend_transition(self.transition, a, b, progress, out)
+            for layer in self.static_layers:
+                layer.blend_into(frame)
+        return frame
+
+    def frame_at(self, t):
+        """合成t时刻的画面（无字幕且不在转场中时直接复用静态底图）"""
+        transition = self.transition_at(t)
+        if transition is not None:
+            frame = self.transition_frame(*transition)
+            for layer in self.active_subtitles(t):
+                layer.blend_into(frame)
+            return frame
+        base = self.base_frame(self.slide_index_at(t))
+        active = self.active_subtitles(t)
+        if not active:
+            return base
+        frame = base.copy()
+        for layer in active:
+            layer.blend_into(frame)
+        return frame
+
+    def frame_into(self, out, t):
+        """把t时刻的画面直接合成到预分配的out（高×宽×3 uint8，如共享内存帧槽），不另分配整帧"""
+        transition = self.transition_at(t)
+        if transition is not None:
+            self.transition_frame(*transition, out=out)
+        else:
+            np.copyto(out, self.base_frame(self.slide_index_at(t)))
+        for layer in self.active_subtitles(t):
+            layer.blend_into(out)
+        return out
+
+
+def scale_canvas(canvas_size, scale):
+    """按比例缩放画布尺寸（宽高取偶数，满足yuv420p编码要求）"""
+    if scale == 1.0:
+        return canvas_size
+    w, h = (max(2, int(round(v * scale))) for v in canvas_size)
+    return max(2, w - w % 2), max(2, h - h % 2)
+
+
+def scale_sprite(pixels, scale):
+    """等比缩放贴图数组（RGB/RGBA）"""
+    h, w = pixels.shape[:2]
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    return np.asarray(Image.fromarray(np.ascontiguousarray(pixels)).resize(size, Image.LANCZOS), dtype=np.uint8)
+
+
+def build_render_plan(img_paths, duration, slide_duration=3.0, text="", text_size=30, text_color="#FFFFFF",
+                      text_pos="center,80", watermark_path=None, watermark_alpha=0.5,
+                      watermark_pos="right20,bottom20", subtitle_text="", fps=15, canvas="auto", stats=None,
+                      scale=1.0, transition="none", transition_duration=0.5, subtitle_pos=None):
+    """根据界面参数生成渲染计划（布局规则与原MoviePy合成完全一致）
+    canvas指定尺寸时所有背景图统一缩放到该画布，auto沿用图片最大宽高；
+    scale<1时（草稿预览）先按原分辨率排版，再把画布、贴图和位置整体等比缩小；
+    transition为轮播转场效果（见TRANSITIONS），在每个切换点前transition_duration秒内完成；
+    subtitle_pos（如"center,bottom100"）非空时统一覆盖每行字幕自带的位置（多版式导出时按版式排版）"""
+    if not img_paths or len(img_paths) == 0:
+        raise Exception("❌ 请至少上传一张背景图！")
+    transition = transition or "none"
+    if transition not in TRANSITIONS:
+        raise Exception(f"❌ 未知转场效果：{transition}（可选：{'/'.join(TRANSITIONS)}）")
+    img_paths = [getattr(p, "name", p) for p in img_paths]  # 兼容Gradio临时文件对象
+    canvas_size = parse_canvas(canvas)
+    fit_slides = canvas_size is not None
+    if canvas_size is None:
+        # 画布尺寸：多图取最大宽高（小图居中黑边），只读文件头不解码像素
+        sizes = []
+        for img_path in img_paths:
+            with Image.open(img_path) as img:
+                sizes.append(img.size)
+        canvas_size = (max(w for w, _ in sizes), max(h for _, h in sizes))
+    vid_w, vid_h = canvas_size
+    slides = [(s, e, p) for p, (s, e) in zip(img_paths, slide_schedule(len(img_paths), duration, slide_duration))]
+    out_size = scale_canvas(canvas_size, scale)
+
+    def place(pixels, x, y, opacity=1.0):
+        """按原分辨率坐标放置叠加层（草稿预览时贴图与坐标同比缩小）"""
+        if scale != 1.0:
+            pixels, x, y = scale_sprite(pixels, scale), x * scale, y * scale
+        return Overlay(pixels, x, y, out_size, opacity=opacity)
+
+    # 全局文字（全程显示）
+    static_layers = []
+    if text.strip():
+        with _stage(stats, "text_sprites"):
+            sprite, text_w, text_h = create_text_sprite(text, text_size, parse_color(text_color))
+        tx_str, ty_str = _split_pos(text_pos)
+        tx = parse_pos(tx_str, vid_w, text_w, is_x=True)
+        ty = parse_pos(ty_str, vid_h, text_h, is_x=False)
+        static_layers.append(place(sprite, tx, ty))
+
+    # 水印（可选）
+    if watermark_path and os.path.exists(watermark_path):
+        wm = load_watermark(watermark_path)
+        wx_str, wy_str = _split_pos(watermark_pos)
+        wx = parse_pos(wx_str, vid_w, wm.shape[1], is_x=True)
+        wy = parse_pos(wy_str, vid_h, wm.shape[0], is_x=False)
+        static_layers.append(place(wm, wx, wy, opacity=watermark_alpha))
+
+    # 字幕（超出音频时长的部分截断）
+    subtitles = []
+    if subtitle_text.strip():
+        for sub in parse_subtitles(subtitle_text, vid_w, vid_h):
+            if subtitle_pos:
+                sub["pos_x_str"], sub["pos_y_str"] = _split_pos(subtitle_pos)
+            end = min(sub["end"], duration)
+            if end <= sub["start"]:
+                continue
+            with _stage(stats, "text_sprites"):
+                sprite, sub_w, sub_h = create_text_sprite(sub["content"], sub["font_size"], sub["color"])
+            sub_x = parse_pos(sub["pos_x_str"], vid_w, sub_w, is_x=True)
+            sub_y = parse_pos(sub["pos_y_str"], vid_h, sub_h, is_x=False)
+            subtitles.append((sub["start"], end, place(sprite, sub_x, sub_y)))
+    plan = RenderPlan(out_size, duration, fps, slides, static_layers, subtitles, fit_slides, scale,
+                      transition, float(transition_duration or 0))
+    plan.stats = stats
+    return plan
+
+
+def _ffmpeg_exe():
+    """ffmpeg可执行文件（优先使用moviepy/imageio自带版本）"""
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return os.environ.get("FFMPEG_BINARY", "ffmpeg")
+
+
+def _audio_input(audio):
+    """音频输入参数：AudioAsset按源编码流复制或编码为AAC，字符串路径按原文件重新编码AAC"""
+    if not audio:
+        return [], None
+    if isinstance(audio, AudioAsset):
+        return audio.ffmpeg_input()
+    return ["-i", audio], "aac"
+
+
+def _held_frame_numbers(runs, start_frame, end_frame):
+    """按画面状态写帧时各写入帧的输出帧序号（相对start_frame）：每组画面只写一帧，
+    末组持续多帧时再写一帧收尾（最后一帧只显示一帧时长，否则区间末尾的画面会缩短）"""
+    numbers = [first - start_frame for first, _ in runs]
+    if runs and runs[-1][1] > 1:
+        numbers.append(end_frame - 1 - start_frame)
+    return numbers
+
+
+def _setpts_filter(frame_numbers):
+    """rawvideo输入按写入顺序逐帧计时，把第N个写入帧移到其输出帧序号；没有跳帧（逐帧写入）时返回None
+    表达式只在跳帧处加一项：N + Σ跳过帧数×gte(N, 跳帧后的写入序号)"""
+    terms = "".join(f"+{b - a - 1}*gte(N,{j + 1})"
+                    for j, (a, b) in enumerate(zip(frame_numbers, frame_numbers[1:])) if b - a > 1)
+    return f"setpts='(N{terms})/(FRAME_RATE*TB)'" if terms else None
+
+
+def _filter_script(graph):
+    """滤镜写入临时文件（-filter_script/-filter_complex_script），避免长表达式超出命令行长度限制"""
+    fd, path = tempfile.mkstemp(prefix="mv_filter_", suffix=".txt")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(graph)
+    return path
+
+
+# 边渲染边预览的TS分段时长（秒，实际在关键帧处切分）
+SEGMENT_SECONDS = 2
+
+
+class FFmpegPipeEncoder:
+    """原始RGB帧经stdin直通ffmpeg编码（不经过MoviePy逐帧转换）
+    给出frame_numbers（各写入帧的输出帧序号）时每种画面只写一帧，由ffmpeg按序号设置时间戳，编码器不处理重复帧"""
+
+    def __init__(self, output_path, size, fps, audio=None, codec="libx264", threads=4, profile=None,
+                 segment_dir=None, frame_numbers=None):
+        w, h = size
+        cmd = [_ffmpeg_exe(), "-y", "-loglevel", "error",
+               "-f", "rawvideo", "-vcodec", "rawvideo", "-s", f"{w}x{h}", "-pix_fmt", "rgb24",
+               "-r", str(fps), "-i", "-"]
+        audio_input, audio_codec = _audio_input(audio)
+        if audio_input:
+            cmd += audio_input + ["-map", "0:v:0", "-map", "1:a:0", "-c:a", audio_codec]
+        setpts = _setpts_filter(frame_numbers) if frame_numbers else None
+        self._script = _filter_script(setpts) if setpts else None
+        if setpts:
+            # 可变帧间隔：时间戳仍在1/fps网格上，passthrough使ffmpeg不补重复帧
+            cmd += ["-filter_script:v", self._script, "-fps_mode", "passthrough"]
+        cmd += ["-c:v", codec, "-threads", str(threads)]
+        if profile is not None and codec == "libx264":
+            cmd += profile.x264_args(fps)
+            if setpts:
+                # -g按写入帧数计，长时间静止时再按时间补关键帧（分段切分、拖动定位）
+                cmd += ["-force_key_frames", f"expr:gte(t,n_forced*{profile.gop_seconds})"]
+        if codec == "libx264" and w % 2 == 0 and h % 2 == 0:
+            cmd += ["-pix_fmt", "yuv420p"]
+        if codec == "libx264" and (segment_dir or setpts):
+            # 不用B帧：empty_moov分片MP4不写编辑列表，B帧的解码延迟会让首帧pts落后（画面晚于音频/字幕）；
+            # 帧间隔不均时ffmpeg按前几帧间隔推算B帧dts，各帧时长与轨道时长都会出错
+            cmd += ["-bf", "0"]
+        if segment_dir:
+            # 边渲染边输出：一次编码同时写分片MP4（写入中即可播放）和TS分段（流式预览）
+            # tee下编码器不会自动输出全局头：MP4需要全局头，TS分段在每个关键帧前补SPS/PPS
+            if not audio_input:
+                cmd += ["-map", "0:v:0"]
+            pattern = os.path.join(segment_dir, "seg_%05d.ts")
+            cmd += ["-flags", "+global_header", "-f", "tee",
+                    f"[f=mp4:movflags=+frag_keyframe+empty_moov+default_base_moof]{output_path}|"
+                    f"[f=segment:segment_time={SEGMENT_SECONDS}:segment_format=mpegts:bsfs/v=dump_extra=freq=keyframe]"
+                    f"{pattern}"]
+        else:
+            if setpts:
+                cmd += ["-video_track_timescale", str(fps)]  # 时间刻度取帧率，各帧时间戳都是整帧
+            cmd.append(output_path)
+        self._log = tempfile.TemporaryFile()
+        try:
+            self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._log)
+        except BaseException:
+            self._remove_script()
+            raise
+
+    def _remove_script(self):
+        if self._script:
+            try:
+                os.remove(self._script)
+            except OSError:
+                pass
+            self._script = None
+
+    def write(self, frame):
+        """写入一帧uint8 RGB画面"""
+        try:
+            if not isinstance(frame, memoryview):
+                frame = memoryview(np.ascontiguousarray(frame))
+            self._proc.stdin.write(frame)
+        except (BrokenPipeError, OSError):
+            self.close()
+            raise
+
+    def close(self):
+        """结束编码，ffmpeg失败时抛出其错误信息"""
+        if self._proc.stdin and not self._proc.stdin.closed:
+            try:
+                self._proc.stdin.close()
+            except OSError:
+                pass
+        code = self._proc.wait()
+        self._remove_script()
+        self._log.seek(0)
+        err = self._log.read().decode("utf-8", "replace").strip()
+        self._log.close()
+        if code != 0:
+            raise Exception(f"视频编码失败（ffmpeg退出码{code}）：{err[-500:]}")
+
+
+class _PipeWriter:
+    """多路编码器的一路原始帧输入管道"""
+
+    def __init__(self, file):
+        self._file = file
+
+    def write(self, frame):
+        if not isinstance(frame, memoryview):
+            frame = memoryview(np.ascontiguousarray(frame))
+        self._file.write(frame)
+
+    def close(self):
+        if not self._file.closed:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+
+
+# 额外的输入管道靠pass_fds把读端留给ffmpeg（pipe:N），只有POSIX支持；
+# 其他平台（Windows）多版式时每种版式单独一个ffmpeg进程，经stdin输入
+MULTI_PIPE_INPUTS = os.name == "posix"
+
+
+class FFmpegMultiEncoder:
+    """一次ffmpeg调用编码多个版本：每种版式一路管道输入，经split/scale分发到各输出，音频只读一次
+    只有一路输入时经stdin写入（各平台通用）；frame_numbers为各路输入的写入帧输出序号（见FFmpegPipeEncoder），每种画面只写一帧"""
+
+    def __init__(self, input_sizes, fps, outputs, audio=None, threads=4, frame_numbers=None):
+        # outputs：[(输出路径, 输入序号, 缩放后尺寸或None, x264参数)]
+        cmd = [_ffmpeg_exe(), "-y", "-loglevel", "error"]
+        use_stdin = len(input_sizes) == 1
+        read_fds, write_fds = [], []
+        for w, h in input_sizes:
+            if use_stdin:
+                source = "-"
+            else:
+                read_fd, write_fd = os.pipe()
+                read_fds.append(read_fd)
+                write_fds.append(write_fd)
+                source = f"pipe:{read_fd}"
+            cmd += ["-f", "rawvideo", "-vcodec", "rawvideo", "-s", f"{w}x{h}", "-pix_fmt", "rgb24",
+                    "-r", str(fps), "-i", source]
+        audio_input, audio_codec = _audio_input(audio)
+        cmd += audio_input
+        graph = []
+        held = []  # 各路输入是否按画面状态写帧
+        for i in range(len(input_sizes)):
+            targets = [j for j, output in enumerate(outputs) if output[1] == i]
+            setpts = _setpts_filter(frame_numbers[i]) if frame_numbers else None
+            held.append(bool(setpts))
+            graph.append(f"[{i}:v]" + (f"{setpts}," if setpts else "") + f"split={len(targets)}"
+                         + "".join(f"[s{j}]" for j in targets))
+            for j in targets:
+                size = outputs[j][2]
+                graph.append(f"[s{j}]scale={size[0]}:{size[1]}:flags=lanczos[o{j}]" if size else f"[s{j}]null[o{j}]")
+        self._script = _filter_script(";".join(graph))
+        cmd += ["-filter_complex_script", self._script]
+        for j, (path, i, _, x264_args) in enumerate(outputs):
+            cmd += ["-map", f"[o{j}]"]
+            if audio_input:
+                cmd += ["-map", f"{len(input_sizes)}:a:0", "-c:a", audio_codec]
+            cmd += ["-c:v", "libx264", "-threads", str(threads)] + x264_args + ["-pix_fmt", "yuv420p"]
+            if held[i]:
+                # 同FFmpegPipeEncoder：可变帧间隔不补重复帧、不用B帧，时间刻度取帧率
+                cmd += ["-fps_mode", "passthrough", "-bf", "0", "-video_track_timescale", str(fps)]
+            cmd.append(path)
+        self._log = tempfile.TemporaryFile()
+        try:
+            if use_stdin:
+                self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                              stderr=self._log)
+            else:
+                self._proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                              stderr=self._log, pass_fds=read_fds)
+        except BaseException:
+            for fd in read_fds + write_fds:
+                os.close(fd)
+            os.remove(self._script)
+            raise
+        for fd in read_fds:
+            os.close(fd)  # 读端已交给ffmpeg
+        if use_stdin:
+            self.inputs = [_PipeWriter(self._proc.stdin)]
+        else:
+            self.inputs = [_PipeWriter(os.fdopen(fd, "wb")) for fd in write_fds]
+
+    def close(self):
+        """关闭所有输入管道并等待编码结束，ffmpeg失败时抛出其错误信息"""
+        for writer in self.inputs:
+            writer.close()
+        code = self._proc.wait()
+        try:
+            os.remove(self._script)
+        except OSError:
+            pass
+        self._log.seek(0)
+        err = self._log.read().decode("utf-8", "replace").strip()
+        self._log.close()
+        if code != 0:
+            raise Exception(f"多版本编码失败（ffmpeg退出码{code}）：{err[-500:]}")
+
+
+# ===================== 编码档位：x264参数按用途分档，并按本机实测吞吐自动调优 =====================
+class EncoderProfile:
+    """编码档位：x264 preset/CRF/tune、帧率、GOP（秒）与线程数（None=自动）"""
+
+    def __init__(self, name, preset, crf, fps, gop_seconds, threads=None, tune="stillimage", scale=1.0, label=""):
+        self.name = name
+        self.preset = preset
+        self.crf = crf
+        self.fps = fps
+        self.gop_seconds = gop_seconds
+        self.threads = threads
+        self.tune = tune
+        self.scale = scale  # 输出分辨率相对画布的比例（草稿<1，排版坐标不变）
+        self.label = label or name
+
+    def x264_args(self, fps=None):
+        gop = max(1, int(round((fps or self.fps) * self.gop_seconds)))
+        args = ["-preset", self.preset, "-crf", str(self.crf), "-g", str(gop)]
+        return args + ["-tune", self.tune] if self.tune else args
+
+    def replace(self, **changes):
+        values = dict(self.to_dict(), label=self.label)
+        values.update(changes)
+        return EncoderProfile(**values)
+
+    def to_dict(self):
+        return {"name": self.name, "preset": self.preset, "crf": self.crf, "fps": self.fps,
+                "gop_seconds": self.gop_seconds, "threads": self.threads, "tune": self.tune, "scale": self.scale}
+
+
+ENCODER_PROFILES = {
+    "draft": EncoderProfile("draft", "ultrafast", 30, 10, 4, scale=0.5, label="草稿（半分辨率，最快出片）"),
+    "standard": EncoderProfile("standard", "medium", 23, 15, 2, label="标准（默认）"),
+    "archival": EncoderProfile("archival", "slow", 18, 30, 2, label="存档（高画质，最慢）"),
+}
+DEFAULT_ENCODER_PROFILE = "standard"
+# x264 preset由快到慢（画质由低到高）
+X264_PRESETS = ("ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower")
+# 校准结果文件（相对运行目录，可用环境变量覆盖）
+ENCODER_CALIBRATION_PATH = os.environ.get("MV_ENCODER_CALIBRATION", "encoder_calibration.json")
+_calibration = None
+_calibration_lock = threading.Lock()
+
+
+def _calibration_frames(size, n_frames):
+    """校准用画面：静态噪声背景 + 每5帧变化一次的色块（近似轮播+字幕的内容特征）"""
+    w, h = size
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+    frames = []
+    for i in range(n_frames):
+        frame = base.copy()
+        y0 = (i // 5 * 37) % max(1, h - h // 8)
+        frame[y0:y0 + h // 8, w // 8:w - w // 8] = (i * 40) % 256
+        frames.append(frame)
+    return frames
+
+
+def calibrate_encoder(size=(1280, 720), n_frames=45, presets=None, thread_counts=None, output_path=None):
+    """实测本机各preset×线程数的x264编码吞吐（像素/秒），结果写入校准文件并立即生效"""
+    cpu = os.cpu_count() or 1
+    presets = list(presets or X264_PRESETS[:-1])
+    thread_counts = sorted({t for t in (thread_counts or (1, 2, 4, cpu)) if 1 <= t <= cpu})
+    frames = _calibration_frames(size, n_frames)
+    results = []
+    tmp_dir = tempfile.mkdtemp(prefix="calibrate_")
+    try:
+        for preset in presets:
+            profile = EncoderProfile("calibrate", preset, 23, 15, 2)
+            for threads in thread_counts:
+                path = os.path.join(tmp_dir, f"{preset}_{threads}.mp4")
+                t0 = time.perf_counter()
+                encoder = FFmpegPipeEncoder(path, size, profile.fps, threads=threads, profile=profile)
+                for frame in frames:
+                    encoder.write(frame)
+                encoder.close()
+                seconds = time.perf_counter() - t0
+                results.append({"preset": preset, "threads": threads, "fps": round(n_frames / seconds, 2),
+                                "pixel_rate": round(n_frames * size[0] * size[1] / seconds)})
+                logger.info("编码校准：preset=%s threads=%d %.1f帧/秒", preset, threads, n_frames / seconds)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    calibration = {"created": time.time(), "cpu_count": cpu, "size": list(size), "results": results}
+    output_path = output_path or ENCODER_CALIBRATION_PATH
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(calibration, f, ensure_ascii=False, indent=2)
+    global _calibration
+    with _calibration_lock:
+        _calibration = calibration
+    return calibration
+
+
+def load_encoder_calibration():
+    """读取校准结果（未校准或CPU核数变化时返回None）"""
+    global _calibration
+    with _calibration_lock:
+        if _calibration is None and os.path.exists(ENCODER_CALIBRATION_PATH):
+            try:
+                with open(ENCODER_CALIBRATION_PATH, "r", encoding="utf-8") as f:
+                    _calibration = json.load(f)
+            except (OSError, ValueError):
+                logger.warning("编码校准文件无法读取：%s", ENCODER_CALIBRATION_PATH)
+                _calibration = {}
+        calibration = _calibration
+    if not calibration or calibration.get("cpu_count") != (os.cpu_count() or 1):
+        return None
+    return calibration
+
+
+def _pick_threads(results, preset):
+    """同一preset下取达到最高吞吐90%的最少线程数，把多余核留给并发任务"""
+    rows = [r for r in results if r["preset"] == preset]
+    if not rows:
+        return None
+    best = max(r["pixel_rate"] for r in rows)
+    return min(r["threads"] for r in rows if r["pixel_rate"] >= 0.9 * best)
+
+
+def resolve_encoder_profile(name=None, n_frames=0, size=(0, 0), budget_seconds=None, calibration=None):
+    """按名称取编码档位并按校准数据定线程数；给定编码时间预算时在不超过档位画质的preset中选最慢且能按时完成的"""
+    name = name or DEFAULT_ENCODER_PROFILE
+    if name not in ENCODER_PROFILES:
+        raise MVError(f"❌ 未知编码档位：{name}（可选：{'/'.join(ENCODER_PROFILES)}）")
+    profile = ENCODER_PROFILES[name]
+    calibration = calibration or load_encoder_calibration()
+    if not calibration:
+        return profile.replace(threads=profile.threads or min(4, os.cpu_count() or 1))
+    results = calibration["results"]
+    preset = profile.preset
+    if budget_seconds and n_frames > 0:
+        pixels = n_frames * size[0] * size[1]
+        limit = X264_PRESETS.index(profile.preset) if profile.preset in X264_PRESETS else len(X264_PRESETS) - 1
+        candidates = [p for p in X264_PRESETS[:limit + 1] if any(r["preset"] == p for r in results)]
+        for candidate in reversed(candidates):
+            rate = max(r["pixel_rate"] for r in results if r["preset"] == candidate)
+            preset = candidate
+            if pixels / rate <= budget_seconds:
+                break
+    threads = profile.threads or _pick_threads(results, preset) or min(4, os.cpu_count() or 1)
+    return profile.replace(preset=preset, threads=threads)
+
+
+def _frame_groups(plan, start_frame=0, end_frame=None, change_points_only=True):
+    """[start_frame, end_frame)区间要写入编码器的画面组[(起始帧, 帧数)]：按变化点分组，或逐帧（每组1帧）"""
+    end_frame = plan.n_frames if end_frame is None else end_frame
+    if change_points_only:
+        return plan.frame_runs(start_frame, end_frame)
+    return [(i, 1) for i in range(start_frame, end_frame)]
+
+
+def _write_frames(plan, encoder, runs, start_frame, end_frame, progress=None, compositors=0):
+    """把各画面组写入编码器：每组只合成、写入一帧（末组多写一帧收尾，见_held_frame_numbers），
+    progress(已完成帧数)按组回调；compositors>0且画面组足够多时由多个合成进程经共享内存帧环供帧"""
+    stats = plan.stats
+    if compositors > 0 and len(runs) >= COMPOSITOR_MIN_RUNS:
+        _write_frames_pipelined(plan, encoder, runs, start_frame, compositors, progress)
+    else:
+        for k, (first, count) in enumerate(runs):
+            frame = _timed_frame(plan, first / plan.fps)
+            with _stage(stats, "encode"):  # 写管道被阻塞的时间即编码器跟不上的时间
+                encoder.write(frame)
+                if count > 1 and k == len(runs) - 1:
+                    encoder.write(frame)
+            if progress:
+                progress(first + count - start_frame)
+    if stats is not None:
+        stats.frames += end_frame - start_frame
+
+
+def _timed_frame(plan, t, out=None):
+    """合成一帧并计入composite耗时（背景图解码单独计入image_decode）；out非空时直接合成到out"""
+    stats = plan.stats
+    if stats is None:
+        return plan.frame_at(t) if out is None else plan.frame_into(out, t)
+    decode_before = stats.stages["image_decode"]
+    composite_before = stats.stages["composite"]
+    t0 = time.perf_counter()
+    frame = plan.frame_at(t) if out is None else plan.frame_into(out, t)
+    elapsed = time.perf_counter() - t0
+    # 扣除frame_at内部已单独计入的解码/静态层预合成时间
+    nested = (stats.stages["image_decode"] - decode_before) + (stats.stages["composite"] - composite_before)
+    stats.add_time("composite", elapsed - nested)
+    return frame
+
+
+def _encode_frames(plan, output_path, audio=None, threads=4, start_frame=0, end_frame=None,
+                   change_points_only=True, progress=None, profile=None, segment_dir=None, compositors=0):
+    """启动一个ffmpeg进程编码指定帧区间（compositors为合成进程数，0=本进程合成）"""
+    end_frame = plan.n_frames if end_frame is None else end_frame
+    runs = _frame_groups(plan, start_frame, end_frame, change_points_only)
+    encoder = FFmpegPipeEncoder(output_path, plan.size, plan.fps, audio=audio, threads=threads, profile=profile,
+                                segment_dir=segment_dir,
+                                frame_numbers=_held_frame_numbers(runs, start_frame, end_frame))
+    try:
+        _write_frames(plan, encoder, runs, start_frame, end_frame, progress, compositors)
+    except BaseException:
+        try:
+            encoder.close()
+        except Exception:
+            pass
+        raise
+    with _stage(plan.stats, "encode"):
+        encoder.close()
+    return output_path
+
+
+# ===================== 共享内存帧环：多进程合成，单编码器按序消费 =====================
+# 单编码器路径（边渲染边输出、单进程渲染）的合成进程数，0=在主进程合成
+COMPOSITOR_WORKERS = int(os.environ.get("MV_COMPOSITORS", str(min(4, (os.cpu_count() or 1) // 2))))
+# 每个合成进程在帧环中的槽位数（槽位总数为合成进程数的整数倍）
+RING_SLOTS_PER_WORKER = 2
+# 不同画面少于此数时不启动合成进程（无转场、字幕少时合成开销远小于进程启动开销）
+COMPOSITOR_MIN_RUNS = 48
+
+
+class FrameRing:
+    """共享内存环形帧缓冲：nslots个预分配帧槽，每槽一对信号量（empty=可写、full=可读）
+    合成进程等empty再写、编码端等full再读，环满时合成进程自动等待（背压）；跨进程只传槽位内存，不pickle帧"""
+
+    def __init__(self, size, nslots, ctx):
+        from multiprocessing import shared_memory
+        w, h = size
+        self.shape = (h, w, 3)
+        self.nslots = nslots
+        self.slot_bytes = w * h * 3
+        self._shm = shared_memory.SharedMemory(create=True, size=self.slot_bytes * nslots)
+        self._owner = True
+        self.empty = [ctx.Semaphore(1) for _ in range(nslots)]
+        self.full = [ctx.Semaphore(0) for _ in range(nslots)]
+        self._map_slots()
+
+    def _map_slots(self):
+        self.slots = [np.ndarray(self.shape, np.uint8, self._shm.buf, i * self.slot_bytes)
+                      for i in range(self.nslots)]
+
+    def __getstate__(self):
+        # spawn方式启动合成进程时只传共享内存名与信号量，子进程按名映射同一块内存
+        return {"name": self._shm.name, "shape": self.shape, "nslots": self.nslots,
+                "slot_bytes": self.slot_bytes, "empty": self.empty, "full": self.full}
+
+    def __setstate__(self, state):
+        from multiprocessing import shared_memory
+        self.__dict__.update((k, v) for k, v in state.items() if k != "name")
+        self._shm = shared_memory.SharedMemory(name=state["name"])
+        self._owner = False
+        self._map_slots()
+
+    def view(self, slot):
+        """帧槽的只读字节视图（直接写入编码器管道）"""
+        return self._shm.buf[slot * self.slot_bytes:(slot + 1) * self.slot_bytes]
+
+    def close(self):
+        """解除映射；创建方同时释放共享内存"""
+        self.slots = []
+        try:
+            self._shm.close()
+        except BufferError:
+            pass  # 仍有视图未释放时由进程退出回收映射
+        if self._owner:
+            self._shm.unlink()
+
+
+def _compositor_worker(plan, ring, runs, worker, n_workers, results, with_stats):
+    """合成进程：第k个不同画面（k ≡ worker mod n_workers）写入第k % nslots号槽，槽位空闲才写"""
+    plan.stats = RenderStats() if with_stats else None
+    try:
+        for k in range(worker, len(runs), n_workers):
+            slot = k % ring.nslots
+            ring.empty[slot].acquire()
+            _timed_frame(plan, runs[k][0] / plan.fps, out=ring.slots[slot])
+            ring.full[slot].release()
+    except BaseException as e:
+        results.put(("error", worker, f"{type(e).__name__}: {e}"))
+        sys.exit(1)
+    results.put(("done", worker, plan.stats.to_dict() if plan.stats else None))
+
+
+def _compositor_error(procs, results):
+    """合成进程异常退出时取出其错误信息"""
+    failed = [p for p in procs if p.exitcode not in (None, 0)]
+    if not failed:
+        return None
+    while True:
+        try:
+            status, worker, payload = results.get(timeout=1)
+        except queue.Empty:
+            return f"合成进程异常退出（退出码{failed[0].exitcode}）"
+        if status == "error":
+            return payload
+
+
+def _write_frames_pipelined(plan, encoder, runs, start_frame, n_workers, progress=None):
+    """多进程合成 + 单编码器：n_workers个合成进程把各不同画面写入共享内存帧环，主进程按顺序把帧槽写入编码器
+    槽位总数为进程数的整数倍，每个槽只归一个合成进程，按序消费不需要重排；合成与编码完全重叠，
+    吞吐取决于两者中较慢的一个；frame_wait为编码端等待合成的时间（大于0说明合成是瓶颈）"""
+    import multiprocessing
+    ctx = multiprocessing.get_context()
+    stats = plan.stats
+    n_workers = max(1, min(n_workers, len(runs)))
+    ring = FrameRing(plan.size, n_workers * RING_SLOTS_PER_WORKER, ctx)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=_compositor_worker, daemon=True,
+                         args=(plan, ring, runs, i, n_workers, results, stats is not None))
+             for i in range(n_workers)]
+    try:
+        for proc in procs:
+            proc.start()
+        for k, (first, count) in enumerate(runs):
+            slot = k % ring.nslots
+            with _stage(stats, "frame_wait"):
+                while not ring.full[slot].acquire(timeout=0.5):
+                    error = _compositor_error(procs, results)
+                    if error:
+                        raise Exception(f"画面合成失败：{error}")
+            frame = ring.view(slot)
+            try:
+                with _stage(stats, "encode"):
+                    encoder.write(frame)
+                    if count > 1 and k == len(runs) - 1:
+                        encoder.write(frame)
+            finally:
+                frame.release()
+            ring.empty[slot].release()
+            if progress:
+                progress(first + count - start_frame)
+        pending = len(procs)
+        while pending:
+            try:
+                status, worker, payload = results.get(timeout=0.5)
+            except queue.Empty:
+                error = _compositor_error(procs, results)
+                if error:
+                    raise Exception(f"画面合成失败：{error}")
+                continue
+            if status == "error":
+                raise Exception(f"画面合成失败：{payload}")
+            if stats is not None and payload:
+                stats.merge(payload)
+            pending -= 1
+        for proc in procs:
+            proc.join()
+    finally:
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+                proc.join()
+        results.close()
+        ring.close()
+
+
+def plan_chunks(plan, n_chunks):
+    """按轮播切换点把帧序号切成约n_chunks段，返回[(起始帧, 结束帧)]（单张图过长时再均分）"""
+    n_frames = plan.n_frames
+    if n_frames <= 0:
+        return []
+    frame_times = np.arange(n_frames) / plan.fps
+    cuts = np.searchsorted(frame_times, [s for s, _, _ in plan.slides[1:]], side="left")
+    bounds = sorted({0, n_frames, *(int(c) for c in cuts if 0 < c < n_frames)})
+    target = max(1, -(-n_frames // max(1, n_chunks)))
+    chunks = []
+    start = 0
+    for b in bounds[1:]:
+        # 在切换点处累积到目标长度即切段
+        if b - start >= target or b == n_frames:
+            chunks.append((start, b))
+            start = b
+    # 超长段（如单张图全程）按目标长度均分，保证各核都有活干
+    result = []
+    for a, b in chunks:
+        pieces = max(1, round((b - a) / target))
+        edges = np.linspace(a, b, pieces + 1).astype(int)
+        result.extend((int(x), int(y)) for x, y in zip(edges[:-1], edges[1:]) if y > x)
+    return result
+
+
+def _render_chunk(plan, start_frame, end_frame, chunk_path, threads, with_stats=False, profile=None):
+    """进程池任务：渲染一段无音频的视频片段，with_stats时返回本段统计"""
+    plan.stats = RenderStats() if with_stats else None
+    _encode_frames(plan, chunk_path, None, threads, start_frame, end_frame, profile=profile)
+    return plan.stats.to_dict() if plan.stats else None
+
+
+def concat_chunks(chunk_paths, output_path, audio=None, chunk_frames=None, fps=None):
+    """流复制拼接视频片段（不重新编码），并一次性混入音轨
+    给出各段帧数chunk_frames与帧率时按帧数指定各段时长（按画面状态编码的片段帧间隔不均，
+    容器推算的时长不含最后一帧），输出时间刻度取帧率"""
+    list_path = output_path + ".concat.txt"
+    with open(list_path, "w", encoding="utf-8") as f:
+        for i, chunk_path in enumerate(chunk_paths):
+            escaped = os.path.abspath(chunk_path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+            if chunk_frames:
+                f.write(f"duration {chunk_frames[i] / fps:.6f}\n")
+    cmd = [_ffmpeg_exe(), "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_path]
+    audio_input, audio_codec = _audio_input(audio)
+    if audio_input:
+        cmd += audio_input + ["-map", "0:v:0", "-map", "1:a:0", "-c:a", audio_codec]
+    cmd += ["-c:v", "copy"]
+    if chunk_frames:
+        cmd += ["-video_track_timescale", str(fps)]
+    cmd.append(output_path)
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    finally:
+        os.remove(list_path)
+    if result.returncode != 0:
+        raise Exception(f"视频拼接失败：{result.stderr.decode('utf-8', 'replace').strip()[-500:]}")
+    return output_path
+
+
+def _encoder_threads(profile, workers, stats=None):
+    """workers个编码进程同时运行时每个进程的x264线程数：平分CPU核数，且不超过档位按校准选定的线程数；
+    stats.encoder记录实际使用的线程数与同时运行的编码进程数"""
+    threads = max(1, (os.cpu_count() or 1) // max(1, workers))
+    if profile is not None and profile.threads:
+        threads = min(threads, profile.threads)
+    if stats is not None and stats.encoder is not None:
+        stats.encoder.update(threads=threads, parallel_encoders=workers)
+    return threads
+
+
+def _render_chunk_files(plan, jobs, workers, profile=None, progress=None):
+    """渲染[(起始帧, 结束帧, 输出路径)]各段：多段且workers>1时进程池并行，否则在本进程依次编码"""
+    stats = plan.stats
+    if workers <= 1 or len(jobs) <= 1:
+        threads = _encoder_threads(profile, 1, stats)
+        done_frames = 0
+        for a, b, path in jobs:
+            base = done_frames
+            _encode_frames(plan, path, None, threads, a, b, profile=profile,
+                           progress=(lambda n: progress(base + n)) if progress else None)
+            done_frames += b - a
+        return
+    workers = min(workers, len(jobs))
+    threads = _encoder_threads(profile, workers, stats)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_render_chunk, plan.for_frames(a, b), a, b, path, threads, stats is not None,
+                               profile): b - a
+                   for a, b, path in jobs}
+        done_frames = 0
+        for fut in as_completed(futures):
+            chunk_stats = fut.result()
+            done_frames += futures[fut]
+            if stats is not None:
+                stats.merge(chunk_stats)
+                stats.frames += futures[fut]
+            if progress:
+                progress(done_frames)
+
+
+def render_plan_parallel(plan, output_path, audio=None, workers=None, progress=None, profile=None):
+    """多进程分段渲染：按轮播切换点切段并行编码，流复制拼接后统一混入音频"""
+    workers = workers or os.cpu_count() or 1
+    chunks = plan_chunks(plan, workers)
+    if len(chunks) <= 1:
+        return _encode_frames(plan, output_path, audio, threads=_encoder_threads(profile, 1, plan.stats),
+                              progress=progress, profile=profile)
+    stats = plan.stats
+    chunk_dir = tempfile.mkdtemp(prefix="chunks_", dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        chunk_paths = [os.path.join(chunk_dir, f"chunk_{i:05d}.mp4") for i in range(len(chunks))]
+        _render_chunk_files(plan, [(a, b, path) for (a, b), path in zip(chunks, chunk_paths)], workers,
+                            profile, progress)
+        if stats is not None:
+            stats.add_temp_bytes(sum(os.path.getsize(p) for p in chunk_paths))
+        with _stage(stats, "mux"):
+            return concat_chunks(chunk_paths, output_path, audio, [b - a for a, b in chunks], plan.fps)
+    finally:
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+
+
+# 增量渲染的分段时长（秒，实际按GOP整数倍对齐）
+RENDER_CHUNK_SECONDS = float(os.environ.get("MV_CHUNK_SECONDS", "4"))
+# 分段输入清单格式变化时递增，使旧分段失效
+CHUNK_MANIFEST_VERSION = 1
+
+
+def fixed_chunks(plan, profile=None, chunk_seconds=RENDER_CHUNK_SECONDS):
+    """按固定时长切段（每段帧数为GOP整数倍），分段边界与字幕无关，编辑字幕后未受影响的分段不变"""
+    gop = max(1, int(round(plan.fps * (profile.gop_seconds if profile else 1.0))))
+    step = max(1, int(round(chunk_seconds * plan.fps / gop))) * gop
+    return [(a, min(a + step, plan.n_frames)) for a in range(0, plan.n_frames, step)]
+
+
+def chunk_key(plan, start_frame, end_frame, profile=None, codec="libx264"):
+    """分段缓存键：输入清单 + 编码参数的哈希"""
+    payload = {"_version": CHUNK_MANIFEST_VERSION, "codec": codec,
+               "encoder": profile.x264_args(plan.fps) if profile else None,
+               "inputs": plan.chunk_inputs(start_frame, end_frame)}
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def render_plan_incremental(plan, output_path, store, audio=None, workers=1, progress=None, profile=None):
+    """增量渲染：固定GOP对齐分段，分段按输入清单哈希存入store（RenderCache）；
+    只重新编码清单有变化的分段（如改动字幕所在的时间段），其余直接复用，最后流复制拼接"""
+    stats = plan.stats
+    chunks = fixed_chunks(plan, profile)
+    keys = [chunk_key(plan, a, b, profile) for a, b in chunks]
+    # 本次用到的分段在拼接完成前不被缓存淘汰（包括本次新写入分段触发的淘汰）
+    for key in set(keys):
+        store.pin(key)
+    try:
+        # 清单相同的分段（如同一张图长时间显示且无字幕变化）画面完全相同，每个键只编码一次
+        missing = OrderedDict()
+        for i, key in enumerate(keys):
+            if key not in missing and store.get(key) is None:
+                missing[key] = i
+        rendered_frames = sum(chunks[i][1] - chunks[i][0] for i in missing.values())
+        reused_frames = plan.n_frames - rendered_frames
+        if progress and reused_frames:
+            progress(reused_frames)
+        if missing:
+            tmp_dir = tempfile.mkdtemp(prefix="tmp_", dir=ensure_dir(store.cache_dir))
+            try:
+                jobs = [(chunks[i][0], chunks[i][1], os.path.join(tmp_dir, f"{key}.mp4"))
+                        for key, i in missing.items()]
+                _render_chunk_files(plan, jobs, workers or os.cpu_count() or 1, profile,
+                                    (lambda n: progress(reused_frames + n)) if progress else None)
+                for key, (_, _, path) in zip(missing, jobs):
+                    if stats is not None:
+                        stats.add_temp_bytes(os.path.getsize(path))
+                    store.put(key, path)
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        if stats is not None:
+            stats.chunks = {"total": len(chunks), "reused": len(chunks) - len(missing),
+                            "rendered_frames": rendered_frames}
+        logger.debug("增量渲染：共%d段，复用%d段", len(chunks), len(chunks) - len(missing))
+        with _stage(stats, "mux"):
+            return concat_chunks([store._path(key) for key in keys], output_path, audio,
+                                 [b - a for a, b in chunks], plan.fps)
+    finally:
+        for key in set(keys):
+            store.unpin(key)
+
+
+def render_plan_to_file(plan, output_path, audio=None, threads=4, change_points_only=True, workers=1,
+                        progress=None, profile=None, chunk_store=None, segment_dir=None, compositors=None):
+    """合成并直通编码器导出MP4（默认按变化点渲染：每种画面状态只合成、编码一帧，按时间戳保持到下一次变化）
+    workers>1或None时按轮播切换点分段多进程渲染（None=按CPU核数）；progress(已完成帧数)用于进度上报；
+    profile为EncoderProfile时使用其x264参数；传入chunk_store时增量渲染（只重编码有变化的分段）；
+    传入segment_dir时边渲染边输出（分片MP4 + TS分段，按时间顺序单进程编码，不分段并行/增量）；
+    单编码器路径由compositors个合成进程经共享内存帧环供帧（None=COMPOSITOR_WORKERS，0=本进程合成）"""
+    compositors = COMPOSITOR_WORKERS if compositors is None else compositors
+    if segment_dir:
+        return _encode_frames(plan, output_path, audio, threads, change_points_only=change_points_only,
+                              progress=progress, profile=profile, segment_dir=segment_dir,
+                              compositors=compositors)
+    if chunk_store is not None:
+        return render_plan_incremental(plan, output_path, chunk_store, audio, workers, progress, profile)
+    if workers is None or workers > 1:
+        return render_plan_parallel(plan, output_path, audio, workers, progress=progress, profile=profile)
+    return _encode_frames(plan, output_path, audio, threads, change_points_only=change_points_only,
+                          progress=progress, profile=profile, compositors=compositors)
+
+
+def mp3_images_to_mp4(mp3_path, img_paths, slide_duration, text="", text_size=30, text_color="#FFFFFF",
+                      text_pos="center,80", watermark_path=None, watermark_alpha=0.5,
+                      watermark_pos="right20,bottom20", subtitle_text="", canvas="auto", workers=None,
+                      progress=None, stats=None, profile=None, encoder_profile=None, render_budget=None,
+                      chunk_store=None, transition="none", transition_duration=0.5, output_path=None,
+                      segment_dir=None, compositors=None):
+    """核心合成：MP3+多张背景轮播+字幕+水印（静态层预合成，原始帧直通编码器）
+    progress(已完成帧数, 总帧数)可选，用于任务进度上报；stats传入RenderStats收集分阶段统计；
+    profile=True（或环境变量MV_PROFILE=1）时用cProfile记录主进程耗时分布（同一时刻只有一个任务记录）；
+    encoder_profile为编码档位名（draft/standard/archival），render_budget为编码时间预算（秒）；
+    chunk_store（RenderCache）用于增量渲染：再次提交时只重新编码有改动的分段；
+    transition为轮播转场效果（none/crossfade/slide/zoom），transition_duration为转场时长（秒）；
+    segment_dir非空时边渲染边输出：output_path为写入中即可播放的分片MP4，segment_dir下逐个生成TS分段；
+    compositors为单编码器路径的合成进程数（None=COMPOSITOR_WORKERS，0=本进程合成）"""
+    profile = os.environ.get("MV_PROFILE") == "1" if profile is None else profile
+    profiler = _start_profiler() if profile else None
+    t_start = time.perf_counter()
+    try:
+        # 基础校验
+        if not mp3_path or not os.path.exists(mp3_path):
+            raise Exception(f"❌ MP3文件不存在：{mp3_path}")
+        if not img_paths or len(img_paths) == 0:
+            raise Exception("❌ 请至少上传一张背景图！")
+
+        # 从共享音频库获取音频（检测时已解码过则直接复用时长，混流时ffmpeg直接读原文件）
+        with _stage(stats, "audio_load"):
+            audio = audio_store.get(mp3_path)
+        audio_duration = audio.duration
+        encoder = ENCODER_PROFILES.get(encoder_profile or DEFAULT_ENCODER_PROFILE)
+        if encoder is None:
+            raise Exception(f"❌ 未知编码档位：{encoder_profile}（可选：{'/'.join(ENCODER_PROFILES)}）")
+
+        # 生成渲染计划：背景轮播→全局文字→水印→字幕
+        plan = build_render_plan(img_paths, audio_duration, slide_duration, text, text_size, text_color,
+                                 text_pos, watermark_path, watermark_alpha, watermark_pos, subtitle_text,
+                                 fps=encoder.fps, canvas=canvas, stats=stats, scale=encoder.scale,
+                                 transition=transition, transition_duration=transition_duration)
+        # 按本机校准数据确定线程数，给定预算时自动降低preset
+        encoder = resolve_encoder_profile(encoder.name, plan.n_frames, plan.size, render_budget)
+        if stats is not None:
+            stats.encoder = encoder.to_dict()
+
+        # 导出MP4视频（H264编码，兼容性强）
+        output_path = output_path or os.path.join(ensure_dir("temp_output"), f"mv_{uuid.uuid4()}.mp4")
+        frame_progress = (lambda done: progress(done, plan.n_frames)) if progress else None
+        render_plan_to_file(plan, output_path, audio=audio, threads=encoder.threads, workers=workers,
+                            progress=frame_progress, profile=encoder, chunk_store=chunk_store,
+                            segment_dir=segment_dir, compositors=compositors)
+        if stats is not None:
+            stats.output_bytes = os.path.getsize(output_path)
+        return output_path
+    except Exception as e:
+        raise MVError(f"MV生成失败：{str(e)}")
+    finally:
+        if stats is not None:
+            stats.wall_seconds = time.perf_counter() - t_start
+        if profiler is not None:
+            profile_path = _stop_profiler(profiler)
+            if stats is not None:
+                stats.profile_path = profile_path
+
+
+# 多版本导出的默认版本：竖屏9:16、横屏16:9、横屏低码率（与横屏共用版式，只合成一次）
+DEFAULT_RENDITIONS = [
+    {"name": "vertical", "canvas": "1080x1920"},
+    {"name": "landscape", "canvas": "1920x1080"},
+    {"name": "landscape_low", "canvas": "1920x1080", "scale": 0.5, "crf": 28, "max_bitrate": "800k"},
+]
+
+
+def render_plans_multi(plans, outputs, audio=None, threads=None, progress=None, stats=None):
+    """多版式同时渲染：每种版式一个合成线程写入各自管道，同一个ffmpeg进程编码全部版本
+    （不支持多路管道输入的平台上每种版式一个ffmpeg进程，输出相同）"""
+    runs = [_frame_groups(plan) for plan in plans]
+    frame_numbers = [_held_frame_numbers(r, 0, plan.n_frames) for r, plan in zip(runs, plans)]
+    threads = threads or os.cpu_count() or 1
+    if MULTI_PIPE_INPUTS or len(plans) == 1:
+        encoders = [FFmpegMultiEncoder([plan.size for plan in plans], plans[0].fps, outputs, audio, threads,
+                                       frame_numbers)]
+        inputs = encoders[0].inputs
+    else:
+        encoders = []
+        try:
+            for i, plan in enumerate(plans):
+                encoders.append(FFmpegMultiEncoder(
+                    [plan.size], plan.fps, [(path, 0, size, args) for path, k, size, args in outputs if k == i],
+                    audio, max(1, threads // len(plans)), [frame_numbers[i]]))
+        except BaseException:
+            for encoder in encoders:
+                for writer in encoder.inputs:
+                    writer.close()
+                with contextlib.suppress(Exception):
+                    encoder.close()
+            raise
+        inputs = [encoder.inputs[0] for encoder in encoders]
+    total = sum(plan.n_frames for plan in plans)
+    done = [0] * len(plans)
+    errors = []
+
+    def feed(i, plan):
+        plan.stats = RenderStats() if stats is not None else None  # 各线程单独计时，结束后合并
+
+        def report(n):
+            done[i] = n
+            if progress:
+                progress(sum(done), total)
+        try:
+            _write_frames(plan, inputs[i], runs[i], 0, plan.n_frames, progress=report)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            inputs[i].close()  # 本路输入结束（EOF），不影响其他版式
+
+    workers = [threading.Thread(target=feed, args=(i, plan), daemon=True) for i, plan in enumerate(plans)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    with _stage(stats, "encode"):
+        encode_errors = []
+        for encoder in encoders:
+            try:
+                encoder.close()
+            except Exception as e:
+                encode_errors.append(e)
+        if encode_errors:
+            raise encode_errors[0]  # ffmpeg的报错比管道断开更有用，优先抛出
+    if errors:
+        raise errors[0]
+    if stats is not None:
+        for plan in plans:
+            stats.merge(plan.stats.to_dict())
+            stats.frames += plan.stats.frames
+
+
+def mp3_images_to_renditions(mp3_path, img_paths, slide_duration, text="", text_size=30, text_color="#FFFFFF",
+                             text_pos="center,80", watermark_path=None, watermark_alpha=0.5,
+                             watermark_pos="right20,bottom20", subtitle_text="", renditions=None,
+                             encoder_profile=None, transition="none", transition_duration=0.5, output_dir=None,
+                             progress=None, stats=None):
+    """多版本导出：音频解码、文字贴图只做一次，每种版式只合成一次，一次ffmpeg调用编码出全部版本
+    renditions为[{name, canvas, text_pos, watermark_pos, subtitle_pos, scale, crf, max_bitrate}]（除name外均可选，
+    位置缺省沿用全局参数）；canvas与各位置相同的版本共用一次合成，只在编码前缩放。返回{版本名: 视频路径}"""
+    renditions = renditions or DEFAULT_RENDITIONS
+    t_start = time.perf_counter()
+    try:
+        if not mp3_path or not os.path.exists(mp3_path):
+            raise Exception(f"❌ MP3文件不存在：{mp3_path}")
+        names = [str(r.get("name") or "") for r in renditions]
+        if not all(names) or len(set(names)) != len(names):
+            raise Exception("❌ 每个版本都需要不重复的name！")
+        with _stage(stats, "audio_load"):
+            audio = audio_store.get(mp3_path)
+        encoder = resolve_encoder_profile(encoder_profile)
+        if stats is not None:
+            stats.encoder = encoder.to_dict()
+        output_dir = ensure_dir(output_dir or "temp_output")
+        batch_id = uuid.uuid4().hex[:12]
+        layouts = OrderedDict()  # 版式（画布+各元素位置）→ 渲染计划
+        outputs, paths = [], {}
+        for rendition, name in zip(renditions, names):
+            layout = (str(rendition.get("canvas", "auto")), rendition.get("text_pos", text_pos),
+                      rendition.get("watermark_pos", watermark_pos), rendition.get("subtitle_pos"))
+            if layout not in layouts:
+                layouts[layout] = build_render_plan(
+                    img_paths, audio.duration, slide_duration, text, text_size, text_color, layout[1],
+                    watermark_path, watermark_alpha, layout[2], subtitle_text, fps=encoder.fps, canvas=layout[0],
+                    stats=stats, scale=encoder.scale, transition=transition,
+                    transition_duration=transition_duration, subtitle_pos=layout[3])
+            plan = layouts[layout]
+            scale = float(rendition.get("scale", 1.0))
+            x264_args = encoder.replace(crf=rendition.get("crf", encoder.crf)).x264_args(plan.fps)
+            if rendition.get("max_bitrate"):
+                x264_args += ["-maxrate", str(rendition["max_bitrate"]), "-bufsize", str(rendition["max_bitrate"])]
+            path = os.path.join(output_dir, f"mv_{batch_id}_{re.sub(r'[^0-9A-Za-z_-]', '_', name)}.mp4")
+            outputs.append((path, list(layouts).index(layout), scale_canvas(plan.size, scale) if scale != 1.0 else None,
+                            x264_args))
+            paths[name] = path
+        render_plans_multi(list(layouts.values()), outputs, audio, encoder.threads, progress, stats)
+        if stats is not None:
+            stats.output_bytes = sum(os.path.getsize(p) for p in paths.values())
+        return paths
+    except Exception as e:
+        raise MVError(f"多版本导出失败：{str(e)}")
+    finally:
+        if stats is not None:
+            stats.wall_seconds = time.perf_counter() - t_start
+
+
+def render_snapshot(mp3_path, img_paths, slide_duration, text="", text_size=30, text_color="#FFFFFF",
+                    text_pos="center,80", watermark_path=None, watermark_alpha=0.5,
+                    watermark_pos="right20,bottom20", subtitle_text="", canvas="auto", t_ms=0, scale=1.0,
+                    transition="none", transition_duration=0.5):
+    """单帧快照：与正式渲染相同的排版，只合成t_ms毫秒处的一帧（不编码视频），返回RGB数组"""
+    try:
+        if not mp3_path or not os.path.exists(mp3_path):
+            raise Exception(f"❌ MP3文件不存在：{mp3_path}")
+        # 快照只需时长，读文件头即可，冷缓存时不为一帧解码整段音频
+        duration = probe_audio_duration(mp3_path)
+        if not duration or duration <= 0:
+            duration = audio_store.get(mp3_path).duration
+        plan = build_render_plan(img_paths, duration, slide_duration, text, text_size, text_color, text_pos,
+                                 watermark_path, watermark_alpha, watermark_pos, subtitle_text, canvas=canvas,
+                                 scale=scale, transition=transition, transition_duration=transition_duration)
+        t = min(max(0.0, float(t_ms or 0) / 1000.0), duration)
+        return np.array(plan.frame_at(t))
+    except Exception as e:
+        raise MVError(f"快照生成失败：{str(e)}")
+
+
+# ===================== 异步渲染任务：有界线程池 + 排队上限 + 进度/ETA + 按任务ID取结果 =====================
+class QueueFullError(Exception):
+    """渲染队列已满（准入控制拒绝）"""
+
+
+class RenderJob:
+    """单个渲染任务的状态（queued → running → done / failed）"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.status = "queued"
+        self.frames_done = 0
+        self.frames_total = 0
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result_path = None
+        self.error = None
+        self.cache_key = None
+        self.cached = False  # True：直接命中渲染缓存
+        self.stats = None  # 渲染统计（RenderStats.to_dict()）
+        self.partial_path = None  # 边渲染边输出时写入中的分片MP4
+        self.segment_dir = None  # 边渲染边输出时的TS分段目录
+        self.inputs = []  # 渲染期间不被清理的上传文件（音频/背景图/水印）
+
+    def ready_segments(self):
+        """已写完的TS分段路径（编码中最后一个分段可能未写完，不返回）"""
+        if not self.segment_dir or not os.path.isdir(self.segment_dir):
+            return []
+        finished = self.status in ("done", "failed")  # 先取状态再列目录，结束后列出的即全部分段
+        names = sorted(n for n in os.listdir(self.segment_dir) if n.endswith(".ts"))
+        if not finished:
+            names = names[:-1]
+        return [os.path.join(self.segment_dir, n) for n in names]
+
+    def update_progress(self, done, total):
+        self.frames_done, self.frames_total = done, total
+
+    def info(self):
+        """任务进度快照：已完成帧数、百分比、已用时间、预计剩余时间"""
+        now = time.time()
+        elapsed = (self.finished or now) - self.started if self.started else 0.0
+        eta = None
+        if self.status == "running" and self.frames_done > 0 and self.frames_total > 0:
+            eta = elapsed / self.frames_done * (self.frames_total - self.frames_done)
+        percent = 100.0 * self.frames_done / self.frames_total if self.frames_total else 0.0
+        # 首个TS分段写完的耗时，即边渲染边预览的首帧可见时间
+        segments = self.ready_segments()
+        first_segment = round(os.path.getmtime(segments[0]) - self.started, 2) if segments and self.started else None
+        return {
+            "job_id": self.job_id, "status": self.status,
+            "frames_done": self.frames_done, "frames_total": self.frames_total,
+            "percent": round(100.0 if self.status == "done" else percent, 1),
+            "elapsed_seconds": round(elapsed, 1), "eta_seconds": None if eta is None else round(eta, 1),
+            "result": self.result_path, "error": self.error, "cached": self.cached, "stats": self.stats,
+            "progressive": self.segment_dir is not None, "first_segment_seconds": first_segment,
+        }
+
+
+# ===================== 临时文件管理：容量配额 + 过期清理 + 使用中文件登记 =====================
+class ArtifactStore:
+    """输出/临时文件管理：多个目录共享容量配额与过期时间，后台线程定期按LRU清理（修改时间即最近使用时间）
+    下载中、渲染中的文件/目录用pin登记，清理时跳过；宽限期内的新文件不因超额被删（可能正在写入）"""
+
+    def __init__(self, roots, max_bytes, ttl_seconds, sweep_seconds=300, grace_seconds=600):
+        self.roots = list(roots)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sweep_seconds = sweep_seconds
+        self.grace_seconds = grace_seconds
+        self._pins = {}  # 绝对路径 → 引用计数
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def pin(self, path):
+        """登记使用中的文件或目录（目录下的文件一并保留）"""
+        path = os.path.abspath(path)
+        with self._lock:
+            self._pins[path] = self._pins.get(path, 0) + 1
+
+    def unpin(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            count = self._pins.get(path, 0) - 1
+            if count > 0:
+                self._pins[path] = count
+            else:
+                self._pins.pop(path, None)
+
+    @contextlib.contextmanager
+    def use(self, path):
+        """使用期间保留文件，并刷新其最近使用时间"""
+        self.pin(path)
+        try:
+            self.touch(path)
+            yield path
+        finally:
+            self.unpin(path)
+
+    def is_pinned(self, path):
+        """文件本身或其所在目录是否登记为使用中"""
+        path = os.path.abspath(path)
+        with self._lock:
+            if not self._pins:
+                return False
+            while True:
+                if path in self._pins:
+                    return True
+                parent = os.path.dirname(path)
+                if parent == path:
+                    return False
+                path = parent
+
+    @staticmethod
+    def touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _entries(self):
+        entries = []
+        for root in self.roots:
+            for dirpath, _, filenames in os.walk(root):
+                for name in filenames:
+                    full = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(full)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, full))
+        return entries
+
+    def usage(self):
+        """当前文件数与总字节数"""
+        entries = self._entries()
+        return {"files": len(entries), "bytes": sum(size for _, size, _ in entries)}
+
+    def sweep(self, now=None):
+        """清理一次：先删过期文件，再按最近最少使用删到配额以内（跳过使用中/宽限期内的文件），返回清理结果"""
+        now = time.time() if now is None else now
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = freed = 0
+        for mtime, size, full in entries:
+            age = now - mtime
+            # 按使用时间升序：既未过期、又无需（或不能）为配额腾空间时，之后的文件也一样
+            if age <= self.ttl_seconds and (total <= self.max_bytes or age <= self.grace_seconds):
+                break
+            if self.is_pinned(full):
+                continue
+            try:
+                os.remove(full)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+            freed += size
+        self._prune_dirs(now)
+        return {"removed": removed, "freed_bytes": freed, "total_bytes": total}
+
+    def _prune_dirs(self, now):
+        """删除各目录下的空子目录（如已清空的TS分段目录），保留根目录与宽限期内新建的目录"""
+        for root in self.roots:
+            for dirpath, _, _ in sorted(os.walk(root), key=lambda item: len(item[0]), reverse=True):
+                if os.path.abspath(dirpath) == os.path.abspath(root) or self.is_pinned(dirpath):
+                    continue
+                try:
+                    if not os.listdir(dirpath) and now - os.path.getmtime(dirpath) > self.grace_seconds:
+                        os.rmdir(dirpath)
+                except OSError:
+                    pass
+
+    def start(self):
+        """启动后台清理线程（启动时先清理一次，之后每sweep_seconds秒一次；重复调用无副作用）"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._janitor, name="mv-janitor", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _janitor(self):
+        while True:
+            try:
+                result = self.sweep()
+                if result["removed"]:
+                    logger.info("临时文件清理：删除%d个文件，释放%.1fMB，剩余%.1fMB", result["removed"],
+                                result["freed_bytes"] / 1024 / 1024, result["total_bytes"] / 1024 / 1024)
+            except Exception:
+                logger.exception("临时文件清理失败")
+            if self._stop.wait(self.sweep_seconds):
+                return
+
+
+# 渲染结果缓存/分段缓存各有容量上限，其余输出与临时目录统一管理
+artifact_store = ArtifactStore(["temp_output", "temp_text", "temp_subtitles", "temp_slides",
+                                os.environ["GRADIO_TEMP_DIR"]],
+                               STORAGE_QUOTA_MB * 1024 * 1024, STORAGE_TTL_HOURS * 3600, STORAGE_SWEEP_SECONDS)
+
+
+# ===================== 渲染结果缓存：输入内容哈希为键，相同请求直接复用MP4 =====================
+# 渲染输出格式变化时递增，使旧缓存失效
+RENDER_CACHE_VERSION = 1
+# 按文件内容（而非路径）参与哈希的参数
+_FILE_PARAMS = ("mp3_path", "watermark_path")
+# 不影响输出画面的参数
+_NON_OUTPUT_PARAMS = ("workers", "progress", "progressive")
+
+
+def render_cache_key(render_kwargs):
+    """渲染请求指纹：所有输入文件的内容哈希 + 全部参数"""
+    payload = {"_version": RENDER_CACHE_VERSION}
+    for name, value in sorted(render_kwargs.items()):
+        if name in _NON_OUTPUT_PARAMS:
+            continue
+        if name in _FILE_PARAMS:
+            value = file_digest(value) if value and os.path.exists(value) else None
+        elif name == "img_paths":
+            value = [file_digest(getattr(p, "name", p)) for p in value]
+        payload[name] = value
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    """渲染结果磁盘缓存（修改时间即最近使用时间，超出容量按LRU淘汰）"""
+
+    def __init__(self, cache_dir="temp_render_cache", max_bytes=RENDER_CACHE_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._pins = {}  # 使用中的缓存路径 → 引用计数（淘汰时跳过）
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.mp4")
+
+    def pin(self, key):
+        """登记使用中的条目（如拼接前的分段），释放前不被淘汰"""
+        path = self._path(key)
+        with self._lock:
+            self._pins[path] = self._pins.get(path, 0) + 1
+
+    def unpin(self, key):
+        path = self._path(key)
+        with self._lock:
+            count = self._pins.get(path, 0) - 1
+            if count > 0:
+                self._pins[path] = count
+            else:
+                self._pins.pop(path, None)
+
+    def get(self, key):
+        """命中返回缓存视频路径并刷新使用时间，未命中返回None"""
+        path = self._path(key)
+        with self._lock:
+            try:
+                os.utime(path)
+            except OSError:
+                return None
+        return path
+
+    def put(self, key, video_path):
+        """把渲染结果移入缓存并淘汰超额条目，返回缓存后的路径"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        with self._lock:
+            os.replace(video_path, path)
+            self._evict(keep=path)
+        return path
+
+    def _evict(self, keep=None):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".mp4"):
+                continue
+            full = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(full)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, full))
+        total = sum(size for _, size, _ in entries)
+        for _, size, full in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if full == keep or full in self._pins or artifact_store.is_pinned(full):
+                continue
+            try:
+                os.remove(full)
+                total -= size
+            except OSError:
+                pass
+
+
+class RenderJobManager:
+    """渲染任务管理：提交即返回任务ID，有界线程池执行，超出排队上限直接拒绝"""
+
+    def __init__(self, max_workers=MAX_RENDER_JOBS, max_queue=MAX_RENDER_QUEUE, max_history=200, cache=None,
+                 chunk_store=None):
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self.max_history = max_history
+        self.cache = cache
+        self.chunk_store = chunk_store  # 分段缓存：修改字幕后再次提交只重新渲染受影响的分段
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="mv-render")
+        self._jobs = OrderedDict()
+        self._inflight = {}  # 缓存键 → 渲染中的任务ID（相同请求共用一次渲染）
+        self._lock = threading.Lock()
+
+    def active_count(self):
+        """排队中+渲染中的任务数"""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status in ("queued", "running"))
+
+    def submit(self, **render_kwargs):
+        """提交渲染任务（参数同mp3_images_to_mp4），返回任务ID
+        相同输入已有缓存时直接返回已完成任务，正在渲染时返回同一任务ID"""
+        key = render_cache_key(render_kwargs) if self.cache else None
+        progressive = render_kwargs.pop("progressive", False)
+        with self._lock:
+            if key:
+                if key in self._inflight:
+                    return self._inflight[key]
+                cached_path = self.cache.get(key)
+                if cached_path:
+                    job = RenderJob(uuid.uuid4().hex)
+                    job.status, job.cached, job.result_path = "done", True, cached_path
+                    job.started = job.finished = time.time()
+                    self._jobs[job.job_id] = job
+                    self._trim_history()
+                    return job.job_id
+            active = sum(1 for job in self._jobs.values() if job.status in ("queued", "running"))
+            if active >= self.max_workers + self.max_queue:
+                raise QueueFullError(f"❌ 渲染队列已满（{active}个任务进行中），请稍后再试！")
+            job = RenderJob(uuid.uuid4().hex)
+            job.cache_key = key
+            # 上传的音频/背景图/水印在gradio临时目录中，排队与渲染期间不参与临时文件清理
+            job.inputs = [path for path in [render_kwargs.get("mp3_path"), *(render_kwargs.get("img_paths") or []),
+                                            render_kwargs.get("watermark_path")] if path]
+            for path in job.inputs:
+                artifact_store.pin(path)
+            if progressive:
+                job.partial_path = os.path.join(ensure_dir("temp_output"), f"mv_{job.job_id}.mp4")
+                job.segment_dir = ensure_dir(os.path.join("temp_output", f"segments_{job.job_id}"))
+                render_kwargs.update(output_path=job.partial_path, segment_dir=job.segment_dir)
+                # 渲染中的分片MP4与TS分段不参与临时文件清理
+                artifact_store.pin(job.partial_path)
+                artifact_store.pin(job.segment_dir)
+            self._jobs[job.job_id] = job
+            if key:
+                self._inflight[key] = job.job_id
+            self._trim_history()
+        # 多个任务并发时平分CPU，避免分段渲染进程数超卖
+        render_kwargs.setdefault("workers", max(1, (os.cpu_count() or 1) // self.max_workers))
+        self._pool.submit(self._run, job, render_kwargs)
+        return job.job_id
+
+    def _run(self, job, render_kwargs):
+        job.status, job.started = "running", time.time()
+        stats = RenderStats()
+        try:
+            result_path = mp3_images_to_mp4(progress=job.update_progress, stats=stats, chunk_store=self.chunk_store,
+                                            **render_kwargs)
+            if job.cache_key:
+                result_path = self.cache.put(job.cache_key, result_path)
+            job.result_path = result_path
+            job.frames_done = job.frames_total
+            job.status = "done"
+        except Exception as e:
+            job.error, job.status = str(e), "failed"
+        finally:
+            job.finished = time.time()
+            job.stats = stats.to_dict()
+            # 结构化日志：每个任务一行JSON，便于汇总分析
+            logger.info(json.dumps({"event": "render_finished", "job_id": job.job_id, "status": job.status,
+                                    "error": job.error, **job.stats}, ensure_ascii=False))
+            if job.cache_key:
+                with self._lock:
+                    self._inflight.pop(job.cache_key, None)
+            for path in job.inputs:
+                artifact_store.unpin(path)
+            if job.segment_dir:
+                artifact_store.unpin(job.partial_path)
+                artifact_store.unpin(job.segment_dir)
+
+    def _trim_history(self):
+        """只保留最近max_history个已结束任务的记录"""
+        finished = [jid for jid, job in self._jobs.items() if job.status in ("done", "failed")]
+        for jid in finished[:max(0, len(finished) - self.max_history)]:
+            job = self._jobs.pop(jid)
+            if job.segment_dir:
+                shutil.rmtree(job.segment_dir, ignore_errors=True)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get((job_id or "").strip())
+
+    def status(self, job_id):
+        """查询任务进度，任务不存在返回None"""
+        job = self.get(job_id)
+        return job.info() if job else None
+
+    def stats(self, job_id):
+        """查询任务的渲染统计，任务不存在返回None（命中缓存/未结束的任务统计为空）"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        return {"job_id": job.job_id, "status": job.status, "cached": job.cached, "stats": job.stats}
+
+    def result(self, job_id, partial=False):
+        """获取已完成任务的视频路径，未完成/失败时抛出异常
+        partial=True时边渲染边输出的任务在渲染中也返回写入中的分片MP4（已编码部分可直接播放）"""
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(f"❌ 任务不存在：{job_id}")
+        if job.status == "failed":
+            raise RuntimeError(job.error)
+        if partial and job.status == "running" and job.partial_path and os.path.exists(job.partial_path):
+            return job.partial_path
+        if job.status != "done" or not job.result_path or not os.path.exists(job.result_path):
+            raise RuntimeError("❌ 任务尚未完成，请稍后刷新！")
+        return job.result_path
+
+
+render_jobs = RenderJobManager(cache=RenderCache(),
+                               chunk_store=RenderCache(os.path.join("temp_render_cache", "chunks"),
+                                                       RENDER_CHUNK_CACHE_MB * 1024 * 1024))
+
+
+def format_job_status(info):
+    """任务进度转为界面提示文字"""
+    if info is None:
+        return "❌ 任务不存在，请先生成MV！"
+    status_text = {"queued": "⏳ 排队中", "running": "🚀 渲染中", "done": "✅ 已完成", "failed": "❌ 失败"}
+    tip = f"{status_text.get(info['status'], info['status'])}｜任务ID：{info['job_id']}"
+    tip += "（命中缓存）\n" if info["cached"] else "\n"
+    parts = []
+    if info["frames_total"]:
+        parts.append(f"进度：{info['frames_done']}/{info['frames_total']}帧（{info['percent']}%）")
+    parts.append(f"已用时{info['elapsed_seconds']}秒")
+    if info["eta_seconds"] is not None:
+        parts.append(f"预计剩余{info['eta_seconds']}秒")
+    tip += "｜".join(parts)
+    if info["error"]:
+        tip += f"\n{info['error']}"
+    stats = info.get("stats")
+    if stats and info["status"] == "done":
+        memory = f"峰值内存{stats['peak_rss_mb']}MB｜" if stats["peak_rss_mb"] is not None else ""
+        tip += f"\n📊 {stats['fps']}帧/秒｜{memory}临时写入{stats['temp_bytes_written'] // 1024}KB"
+        encoder = stats.get("encoder")
+        if encoder:
+            tip += (f"\n🎞️ 编码档位：{encoder['name']}（preset={encoder['preset']}，CRF {encoder['crf']}，"
+                    f"{encoder['fps']}fps，{encoder['threads']}线程）｜编码速度{stats['speed']}倍速")
+    if info["status"] == "done":
+        tip += f"\n🔗 下载地址（支持断点续传）：/download/{info['job_id']}"
+    return tip
+
+
+def submit_render_job(mp3_path, img_paths, slide_duration, text="", text_size=30, text_color="#FFFFFF",
+                      text_pos="center,80", watermark_path=None, watermark_alpha=0.5,
+                      watermark_pos="right20,bottom20", subtitle_text="", canvas="auto",
+                      encoder_profile=DEFAULT_ENCODER_PROFILE, render_budget=0, transition="none",
+                      transition_duration=0.5, progressive=False):
+    """提交MV渲染任务（立即返回任务ID，不占用Web请求线程）"""
+    import gradio as gr
+    if not mp3_path or not os.path.exists(mp3_path):
+        raise gr.Error("❌ 请先上传MP3音频！")
+    if not img_paths:
+        raise gr.Error("❌ 请至少上传一张背景图！")
+    if (encoder_profile or DEFAULT_ENCODER_PROFILE) not in ENCODER_PROFILES:
+        raise gr.Error(f"❌ 未知编码档位：{encoder_profile}（可选：{'/'.join(ENCODER_PROFILES)}）")
+    try:
+        job_id = render_jobs.submit(
+            mp3_path=mp3_path, img_paths=list(img_paths), slide_duration=slide_duration, text=text,
+            text_size=text_size, text_color=text_color, text_pos=text_pos, watermark_path=watermark_path,
+            watermark_alpha=watermark_alpha, watermark_pos=watermark_pos, subtitle_text=subtitle_text,
+            canvas=canvas, encoder_profile=encoder_profile or DEFAULT_ENCODER_PROFILE,
+            render_budget=float(render_budget) if render_budget else None, transition=transition or "none",
+            transition_duration=transition_duration, progressive=bool(progressive))
+    except QueueFullError as e:
+        raise gr.Error(str(e))
+    return job_id, format_job_status(render_jobs.status(job_id))
+
+
+def poll_render_job(job_id):
+    """刷新任务进度，完成后返回视频用于预览"""
+    info = render_jobs.status(job_id)
+    video = info["result"] if info and info["status"] == "done" else None
+    return format_job_status(info), video
+
+
+def render_job_status(job_id):
+    """API：查询任务进度（JSON）"""
+    import gradio as gr
+    info = render_jobs.status(job_id)
+    if info is None:
+        raise gr.Error(f"❌ 任务不存在：{job_id}")
+    return info
+
+
+def render_job_stats(job_id):
+    """API：查询任务的分阶段耗时、帧率、峰值内存、临时写入量（JSON）"""
+    import gradio as gr
+    info = render_jobs.stats(job_id)
+    if info is None:
+        raise gr.Error(f"❌ 任务不存在：{job_id}")
+    return info
+
+
+def download_video(job_id):
+    """下载指定任务生成的MV（按任务ID取结果，多用户互不串号；边渲染边输出的任务渲染中可下载已编码部分）"""
+    import gradio as gr
+    try:
+        return render_jobs.result(job_id, partial=True)
+    except KeyError:
+        raise gr.Error("❌ 请先生成MV后再下载！")
+    except RuntimeError as e:
+        raise gr.Error(str(e))
+
+
+def stream_render_job(job_id):
+    """边渲染边预览：逐个返回已写完的TS分段（gr.Video流式输出），渲染结束后停止"""
+    import gradio as gr
+    job = render_jobs.get(job_id)
+    if job is None:
+        raise gr.Error("❌ 任务不存在，请先生成MV！")
+    if not job.segment_dir:
+        # 未开启边渲染边输出（或直接命中缓存）：完成后整段返回
+        while job.status not in ("done", "failed"):
+            time.sleep(0.5)
+        yield download_video(job_id)
+        return
+    sent = 0
+    with artifact_store.use(job.segment_dir):
+        while True:
+            finished = job.status in ("done", "failed")
+            segments = job.ready_segments()
+            for path in segments[sent:]:
+                yield path
+            sent = len(segments)
+            if finished:
+                break
+            time.sleep(0.5)
+    if job.status == "failed":
+        raise gr.Error(job.error)
+
+
+def detect_voice_batch(audio_files, threshold=0.02):
+    """API：批量语音段检测，每完成一个文件推送一次累计结果（按完成顺序，file为文件名）"""
+    import gradio as gr
+    if not audio_files:
+        raise gr.Error("❌ 请先上传音频文件！")
+    results = []
+    for result in detect_voice_segments_batch(list(audio_files), threshold):
+        results.append({"file": os.path.basename(result.pop("path")), **result})
+        yield results
+
+
+def snapshot_frame(mp3_path, img_paths, slide_duration, text="", text_size=30, text_color="#FFFFFF",
+                   text_pos="center,80", watermark_path=None, watermark_alpha=0.5,
+                   watermark_pos="right20,bottom20", subtitle_text="", canvas="auto", t_ms=0, transition="none",
+                   transition_duration=0.5):
+    """API：预览指定时间点（毫秒）的单帧画面，调整字幕位置/字号无需完整渲染"""
+    import gradio as gr
+    if not img_paths:
+        raise gr.Error("❌ 请至少上传一张背景图！")
+    try:
+        return render_snapshot(mp3_path, list(img_paths), slide_duration, text, text_size, text_color, text_pos,
+                               watermark_path, watermark_alpha, watermark_pos, subtitle_text, canvas, t_ms,
+                               transition=transition or "none", transition_duration=transition_duration)
+    except MVError as e:
+        raise gr.Error(str(e))
+
+
+def render_renditions(mp3_path, img_paths, slide_duration, text="", text_size=30, text_color="#FFFFFF",
+                      text_pos="center,80", watermark_path=None, watermark_alpha=0.5,
+                      watermark_pos="right20,bottom20", subtitle_text="", renditions_json="",
+                      encoder_profile=None, transition="none", transition_duration=0.5):
+    """API：多版本导出（renditions_json为版本列表JSON，留空用默认竖屏/横屏/低码率三版），返回各版本文件"""
+    import gradio as gr
+    if not img_paths:
+        raise gr.Error("❌ 请至少上传一张背景图！")
+    try:
+        renditions = json.loads(renditions_json) if (renditions_json or "").strip() else None
+    except ValueError as e:
+        raise gr.Error(f"❌ 版本配置JSON解析失败：{e}")
+    try:
+        paths = mp3_images_to_renditions(mp3_path, list(img_paths), slide_duration, text, text_size, text_color,
+                                         text_pos, watermark_path, watermark_alpha, watermark_pos, subtitle_text,
+                                         renditions, encoder_profile=encoder_profile,
+                                         transition=transition or "none", transition_duration=transition_duration)
+    except MVError as e:
+        raise gr.Error(str(e))
+    return list(paths.values())
+
+
+# ===================== 无界面批量生成：JSONL清单驱动，多进程并行，输出结果清单 =====================
+def _resolve_path(path, base_dir):
+    """清单中的相对路径按清单文件所在目录解析"""
+    if not path:
+        return path
+    path = os.path.expanduser(str(path))
+    return path if os.path.isabs(path) else os.path.join(base_dir, path)
+
+
+def _as_text(value):
+    """字幕/文案字段兼容字符串或字符串列表"""
+    if isinstance(value, (list, tuple)):
+        return "\n".join(str(v) for v in value)
+    return str(value or "")
+
+
+def run_batch_job(entry, base_dir=".", out_dir="temp_output"):
+    """执行一条清单任务：语音检测 → 字幕匹配 → 渲染，返回含分阶段耗时与错误信息的结果"""
+    t_start = time.time()
+    result = {"id": entry.get("id"), "status": "failed", "output": None, "segments": None,
+              "timings": {}, "error": None}
+    timings = result["timings"]
+    try:
+        audio = _resolve_path(entry.get("audio"), base_dir)
+        images = [_resolve_path(p, base_dir) for p in entry.get("images") or []]
+        style = dict(entry.get("style") or {})
+        subtitle_text = _as_text(entry.get("subtitles"))
+        lyrics = _as_text(entry.get("lyrics"))
+        if not audio or not os.path.exists(audio):
+            raise Exception(f"❌ 音频文件不存在：{audio}")
+
+        # 只给了纯歌词时，先检测语音段再自动匹配时间轴
+        if not subtitle_text.strip() and lyrics.strip():
+            detect = entry.get("detect") or {}
+            t0 = time.time()
+            tip, segments = detect_voice_segments(audio, detect.get("threshold", 0.02),
+                                                  detect.get("min_duration", 0.3))
+            timings["detect"] = round(time.time() - t0, 3)
+            if not segments:
+                raise Exception(tip)
+            result["segments"] = segments
+            offset = entry.get("offset") or {}
+            t0 = time.time()
+            subtitle_text = match_subtitle_with_voice(lyrics, segments, offset.get("start", 0.0),
+                                                      offset.get("end", 0.0))
+            timings["match"] = round(time.time() - t0, 3)
+            if subtitle_text.startswith("❌"):
+                raise Exception(subtitle_text)
+
+        t0 = time.time()
+        stats = RenderStats()
+        render_args = (audio, images, style.get("slide_duration", 3.0), style.get("text", ""),
+                       style.get("text_size", 30), style.get("text_color", "#FFFFFF"),
+                       style.get("text_pos", "center,80"), _resolve_path(style.get("watermark"), base_dir),
+                       style.get("watermark_alpha", 0.5), style.get("watermark_pos", "right20,bottom20"),
+                       subtitle_text)
+        render_kwargs = dict(stats=stats, encoder_profile=style.get("encoder_profile"),
+                             transition=style.get("transition", "none"),
+                             transition_duration=style.get("transition_duration", 0.5))
+        if entry.get("renditions"):
+            # 多版本导出：一次合成/编码输出全部版本
+            video_paths = mp3_images_to_renditions(*render_args, entry["renditions"], **render_kwargs)
+        else:
+            # 批量任务已按条目多进程并行，单条不再启动合成进程
+            video_paths = {None: mp3_images_to_mp4(*render_args, style.get("canvas", "auto"), workers=1,
+                                                   compositors=0, render_budget=style.get("render_budget"),
+                                                   **render_kwargs)}
+        timings["render"] = round(time.time() - t0, 3)
+        result["stats"] = stats.to_dict()
+
+        # 移动到输出目录（多版本按"{id}_{版本名}.mp4"命名）
+        outputs = {}
+        for name, video_path in video_paths.items():
+            if name is None:
+                output = entry.get("output") or f"{result['id']}.mp4"
+            else:
+                output = f"{result['id']}_{re.sub(r'[^0-9A-Za-z_-]', '_', name)}.mp4"
+            output = output if os.path.isabs(output) else os.path.join(out_dir, output)
+            os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+            shutil.move(video_path, output)
+            outputs[name] = output
+        if entry.get("renditions"):
+            result["outputs"] = outputs
+        result["output"], result["status"] = next(iter(outputs.values())), "done"
+    except Exception as e:
+        result["error"] = str(e)
+    timings["total"] = round(time.time() - t_start, 3)
+    return result
+
+
+def run_batch(manifest_path, results_path, jobs=None, out_dir=None):
+    """按JSONL清单批量生成MV，每完成一条立即写入结果清单，返回(成功数, 失败数)"""
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    out_dir = out_dir or os.path.join(base_dir, "batch_output")
+    entries = []
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError as e:
+                entry = {"_error": f"第{line_no}行JSON解析失败：{e}"}
+            entry.setdefault("id", f"job{line_no}")
+            entries.append(entry)
+
+    done = failed = 0
+    jobs = max(1, jobs or os.cpu_count() or 1)
+    with open(results_path, "w", encoding="utf-8") as out, ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {}
+        for entry in entries:
+            if "_error" in entry:
+                # 清单本身解析失败的行直接记为失败
+                out.write(json.dumps({"id": entry["id"], "status": "failed", "error": entry["_error"]},
+                                     ensure_ascii=False) + "\n")
+                failed += 1
+                continue
+            futures[pool.submit(run_batch_job, entry, base_dir, out_dir)] = entry
+        for fut in as_completed(futures):
+            entry = futures[fut]
+            try:
+                result = fut.result()
+            except Exception as e:  # 子进程异常退出
+                result = {"id": entry["id"], "status": "failed", "error": str(e)}
+            done += result["status"] == "done"
+            failed += result["status"] != "done"
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            print(f"{'✅' if result['status'] == 'done' else '❌'} {result['id']}"
+                  f"（{result.get('timings', {}).get('total', 0)}秒）{result.get('error') or ''}")
+    return done, failed
+
+
+# ===================== Gradio界面（3.0最早期版本兼容，无任何高版本组件） =====================
+# 极简CSS美化（适配低版本，仅保留基础好看的样式）
+custom_css = """
+/* 主按钮渐变美化 */
+.gradio-container .button-primary {
+    background: linear-gradient(135deg, #2a93b7 0%, #d94691 100%) !important;
+    border: none !important;
+    color: white !important;
+    font-weight: 600 !important;
+    border-radius: 6px !important;
+}
+/* 按钮hover效果 */
+.gradio-container .button-primary:hover {
+    opacity: 0.9 !important;
+    box-shadow: 0 3px 8px rgba(0,0,0,0.1) !important;
+}
+/* 所有输入框圆角 */
+.gradio-container input, .gradio-container textarea, .gradio-container .slider {
+    border-radius: 6px !important;
+    border: 1px solid #e2e8f0 !important;
+}
+/* 标题文字美化 */
+.gradio-container h1 {
+    color: #2a93b7 !important;
+    font-weight: 700 !important;
+    text-align: center !important;
+    margin-bottom: 20px !important;
+}
+.gradio-container h2, .gradio-container h3 {
+    color: #334155 !important;
+    font-weight: 600 !important;
+    margin-top: 15px !important;
+}
+/* 整体容器内边距 */
+.gradio-container {
+    padding: 20px !important;
+}
+"""
+
+def build_demo():
+    """构建Gradio界面（仅在启动服务或首次访问mv_maker.demo时构建）"""
+    import gradio as gr
+
+    # 构建基础界面（仅用Tabs/Row/Column/基础组件，无任何高级组件）
+    with gr.Blocks(title="🎤 AI翻唱MV生成器（轮播版）", css=custom_css) as demo:
+        # 顶部主标题
+        gr.Markdown("# 🎤 AI翻唱MV生成器（多张背景轮播版）")
+        gr.Markdown("### ✨ 核心功能：多张背景图轮播 | 字幕精准居中 | 语音段自动检测 | 时间轴防重叠")
+        gr.Markdown("---")  # 用markdown横线替代Divider，兼容低版本
+
+        # 隐藏状态变量：存储语音段（替代全局变量，防止数据叠加）
+        voice_segments_state = gr.State(value=[])
+
+        # 标签页（仅用基础TabItem，无icon）
+        with gr.Tabs():
+            # 标签1：音频上传与语音检测
+            with gr.TabItem("音频语音检测"):
+                gr.Markdown("## 🎵 上传MP3音频并检测语音段")
+                mp3_input = gr.Audio(label="上传翻唱MP3音频", type="filepath")
+                detect_threshold = gr.Slider(
+                    label="语音检测阈值（越小越灵敏，杂音多调至0.03-0.04）",
+                    minimum=0.01, maximum=0.1, value=0.02, step=0.01
+                )
+                with gr.Row():
+                    detect_btn = gr.Button("🔍 开始检测语音段", variant="primary")
+                    preview_btn = gr.Button("📈 多阈值预览")
+                voice_result = gr.Textbox(
+                    label="语音检测结果", lines=6,
+                    placeholder="检测结果将显示在这里，会列出所有语音段的起止时间..."
+                )
+                gr.Markdown("### 📂 批量检测（多个音频并行检测，每完成一个即显示结果）")
+                batch_audio = gr.File(label="上传多个音频文件", file_count="multiple", file_types=["audio"])
+                batch_detect_btn = gr.Button("🔍 批量检测语音段")
+                batch_detect_result = gr.JSON(label="批量检测结果（使用上方阈值）")
+                gr.Markdown("---")
+
+            # 标签2：字幕输入与时间轴匹配
+            with gr.TabItem("字幕时间轴生成"):
+                gr.Markdown("## ✏️ 输入纯字幕并匹配语音时间轴")
+                pure_subtitle = gr.Textbox(
+                    label="纯字幕文本（每行一段，行数与语音段数一致，无时间）",
+                    lines=8,
+                    placeholder="示例：\n生活就像一杯清茶\n初入口时或许有些苦涩\n但细细品味\n却能感受到其中的甘甜与清香"
+                )
+                gr.Markdown("### ⏱️ 字幕时间全局偏移")
+                with gr.Row():
+                    global_start_offset = gr.Slider(
+                        label="开始偏移（±秒）：负数=提前显示，正数=延后显示",
+                        minimum=-1.0, maximum=1.0, value=0.0, step=0.1
+                    )
+                    global_end_offset = gr.Slider(
+                        label="结束偏移（±秒）：负数=提前隐藏，正数=延后隐藏",
+                        minimum=-1.0, maximum=1.0, value=0.0, step=0.1
+                    )
+                match_btn = gr.Button("⚡ 一键匹配语音时间轴", variant="primary")
+                matched_subtitle = gr.Textbox(
+                    label="匹配后的带时间轴字幕（可手动微调）", lines=10,
+                    placeholder="匹配后将生成标准格式：开始时间,内容,结束时间,字号,颜色,水平位置,垂直位置..."
+                )
+                gr.Markdown("---")
+
+            # 标签3：核心功能 - 多张背景轮播 + MV生成/下载
+            with gr.TabItem("MV生成与导出"):
+                with gr.Row():
+                    # 左侧：配置区（轮播/文字/水印）
+                    with gr.Column(scale=2):
+                        # 背景轮播核心配置（你的核心需求）
+                        gr.Markdown("## 🖼️ 多张背景图轮播设置")
+                        bg_imgs = gr.File(
+                            label="上传多张背景图（支持批量选择，JPG/PNG均可）",
+                            file_count="multiple", file_types=["image"]
+                        )
+                        slide_duration = gr.Slider(
+                            label="单张图片显示时长（秒），图片多建议设1-2秒",
+                            minimum=1.0, maximum=10.0, value=3.0, step=0.5
+                        )
+                        canvas_size = gr.Dropdown(
+                            label="视频画布尺寸（auto=按图片最大尺寸，指定尺寸时图片等比缩放居中）",
+                            choices=list(CANVAS_PRESETS.keys()), value="auto"
+                        )
+                        with gr.Row():
+                            transition = gr.Dropdown(
+                                label="轮播转场效果",
+                                choices=[(label, name) for name, label in TRANSITIONS.items()], value="none"
+                            )
+                            transition_duration = gr.Slider(
+                                label="转场时长（秒）", minimum=0.2, maximum=2.0, value=0.5, step=0.1
+                            )
+                        with gr.Row():
+                            encoder_profile = gr.Dropdown(
+                                label="编码档位（draft=快速草稿 | standard=标准 | archival=高画质存档）",
+                                choices=[(p.label, name) for name, p in ENCODER_PROFILES.items()],
+                                value=DEFAULT_ENCODER_PROFILE
+                            )
+                            render_budget = gr.Number(
+                                label="编码时间预算（秒，0=不限；需先运行calibrate校准）", value=0, minimum=0
+                            )
+                        gr.Markdown("---")
+
+                        # 全局文字配置
+                        gr.Markdown("## 📜 全局文字（视频全程显示）")
+                        global_text = gr.Textbox(label="文字内容", placeholder="AI翻唱MV | 轮播版 | 字幕精准居中")
+                        global_text_size = gr.Slider(label="文字大小", minimum=10, maximum=100, value=30, step=1)
+                        global_text_color = gr.ColorPicker(label="文字颜色", value="#FFFFFF")
+                        global_text_pos = gr.Textbox(
+                            label="文字位置（示例：center,80 水平居中+距上80px | right20,bottom50 右下20px）",
+                            value="center,80"
+                        )
+                        gr.Markdown("---")
+
+                        # 水印配置（可选）
+                        gr.Markdown("## 🔖 水印设置（可选，建议PNG透明背景）")
+                        watermark_img = gr.Image(label="上传水印图片", type="filepath")
+                        wm_alpha = gr.Slider(label="水印透明度", minimum=0.1, maximum=1.0, value=0.5, step=0.1)
+                        wm_pos = gr.Textbox(label="水印位置（示例：right20,bottom20）", value="right20,bottom20")
+                        gr.Markdown("---")
+
+                        # 操作按钮
+                        with gr.Row():
+                            generate_btn = gr.Button("🚀 生成MV", variant="primary")
+                            refresh_btn = gr.Button("🔄 刷新进度")
+                            download_btn = gr.Button("📥 下载MV")
+                        progressive = gr.Checkbox(
+                            label="边渲染边预览（按时间顺序单进程编码，渲染中即可播放/下载已完成部分）", value=False
+                        )
+                        job_id_box = gr.Textbox(label="任务ID（提交后自动填写，可粘贴查询）")
+                        job_status = gr.Textbox(label="渲染进度", lines=3)
+                        stats_btn = gr.Button("📊 查看渲染统计")
+                        job_stats_json = gr.JSON(label="渲染统计（分阶段耗时/帧率/峰值内存/临时写入量）")
+
+                    # 右侧：字幕微调 + 预览下载
+                    with gr.Column(scale=3):
+                        gr.Markdown("## 🎯 最终字幕配置（可手动修改时间/样式）")
+                        final_subtitle = gr.Textbox(
+                            label="最终字幕（匹配后自动同步，可手动改）",
+                            lines=12, value=""
+                        )
+                        gr.Markdown("---")
+                        gr.Markdown("## 🎥 MV预览与下载")
+                        video_output = gr.Video(label="生成的MV（轮播背景+精准字幕）", height=400)
+                        stream_btn = gr.Button("▶️ 边渲染边看（需勾选边渲染边预览）")
+                        stream_output = gr.Video(label="边渲染边预览", streaming=True, autoplay=True, height=400)
+                        with gr.Row():
+                            snapshot_ms = gr.Number(label="预览时间点（毫秒）", value=0, minimum=0, precision=0)
+                            snapshot_btn = gr.Button("🖼️ 预览单帧（无需完整渲染）")
+                        snapshot_output = gr.Image(label="单帧预览", type="numpy", height=400)
+                        download_output = gr.File(label="下载的MP4视频文件")
+                        gr.Markdown("---")
+                        gr.Markdown("## 📦 多版本导出（一次渲染输出竖屏/横屏/低码率等多个版本）")
+                        renditions_json = gr.Textbox(
+                            label="版本配置JSON（留空=默认三版；可选键：name/canvas/text_pos/watermark_pos/"
+                                  "subtitle_pos/scale/crf/max_bitrate）",
+                            lines=4, value=json.dumps(DEFAULT_RENDITIONS, ensure_ascii=False)
+                        )
+                        renditions_btn = gr.Button("📦 多版本导出")
+                        renditions_output = gr.File(label="各版本视频文件", file_count="multiple")
+
+        # ===================== 绑定所有交互事件（基础绑定，兼容低版本） =====================
+        # 检测语音段
+        detect_btn.click(
+            fn=detect_voice_segments,
+            inputs=[mp3_input, detect_threshold],
+            outputs=[voice_result, voice_segments_state]
+        )
+        # 多阈值预览（只显示各阈值的段数，不改动已检测结果）
+        preview_btn.click(
+            fn=lambda path: preview_thresholds(path)[0],
+            inputs=mp3_input,
+            outputs=voice_result,
+            api_name="preview_thresholds"
+        )
+        # 批量检测：进程池并行，逐个文件推送结果
+        batch_detect_btn.click(
+            fn=detect_voice_batch,
+            inputs=[batch_audio, detect_threshold],
+            outputs=batch_detect_result,
+            api_name="detect_voice_batch"
+        )
+        # 匹配字幕时间轴
+        match_btn.click(
+            fn=match_subtitle_with_voice,
+            inputs=[pure_subtitle, voice_segments_state, global_start_offset, global_end_offset],
+            outputs=matched_subtitle
+        )
+        # 匹配后的字幕自动同步到最终字幕框
+        matched_subtitle.change(
+            fn=lambda x: x,
+            inputs=matched_subtitle,
+            outputs=final_subtitle
+        )
+        # 提交MV渲染任务（核心：传入多张背景图+轮播时长，立即返回任务ID）
+        generate_btn.click(
+            fn=submit_render_job,
+            inputs=[mp3_input, bg_imgs, slide_duration, global_text, global_text_size, global_text_color,
+                    global_text_pos, watermark_img, wm_alpha, wm_pos, final_subtitle, canvas_size,
+                    encoder_profile, render_budget, transition, transition_duration, progressive],
+            outputs=[job_id_box, job_status],
+            api_name="submit_render"
+        )
+        # 单帧快照：调整字幕位置/字号后快速查看效果
+        snapshot_btn.click(
+            fn=snapshot_frame,
+            inputs=[mp3_input, bg_imgs, slide_duration, global_text, global_text_size, global_text_color,
+                    global_text_pos, watermark_img, wm_alpha, wm_pos, final_subtitle, canvas_size, snapshot_ms,
+                    transition, transition_duration],
+            outputs=snapshot_output,
+            api_name="snapshot"
+        )
+        # 多版本导出：同一次渲染编码出全部版本
+        renditions_btn.click(
+            fn=render_renditions,
+            inputs=[mp3_input, bg_imgs, slide_duration, global_text, global_text_size, global_text_color,
+                    global_text_pos, watermark_img, wm_alpha, wm_pos, final_subtitle, renditions_json,
+                    encoder_profile, transition, transition_duration],
+            outputs=renditions_output,
+            api_name="render_renditions"
+        )
+        # 刷新渲染进度，完成后显示预览
+        refresh_btn.click(
+            fn=poll_render_job,
+            inputs=job_id_box,
+            outputs=[job_status, video_output]
+        )
+        # 边渲染边预览：已写完的TS分段逐个推送到播放器
+        stream_btn.click(
+            fn=stream_render_job,
+            inputs=job_id_box,
+            outputs=stream_output,
+            api_name="stream_render"
+        )
+        # API：按任务ID查询进度（JSON）
+        job_status_json = gr.JSON(visible=False)
+        job_id_box.submit(
+            fn=render_job_status,
+            inputs=job_id_box,
+            outputs=job_status_json,
+            api_name="render_status"
+        )
+        # 渲染统计（按任务ID查询）
+        stats_btn.click(
+            fn=render_job_stats,
+            inputs=job_id_box,
+            outputs=job_stats_json,
+            api_name="render_stats"
+        )
+        # 下载MV（按任务ID取结果）
+        download_btn.click(
+            fn=download_video,
+            inputs=job_id_box,
+            outputs=download_output,
+            api_name="download_video"
+        )
+    return demo
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_demo():
+    return build_demo()
+
+
+def __getattr__(name):
+    """兼容旧用法：mv_maker.demo 首次访问时才构建界面"""
+    if name == "demo":
+        return _cached_demo()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# ===================== HTTP下载：支持Range分段读取，下载期间文件不会被清理 =====================
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def parse_range_header(header, size):
+    """解析单段Range请求头（bytes=起-止 / 起- / -末尾长度），返回闭区间(起, 止)；
+    无Range或多段Range返回None（按整文件返回），无法满足时抛ValueError"""
+    if not header:
+        return None
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", header)
+    if match is None or not (match.group(1) or match.group(2)):
+        return None
+    if match.group(1):
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    else:
+        suffix = int(match.group(2))
+        if suffix == 0:
+            raise ValueError(header)
+        start, end = max(0, size - suffix), size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+class FileRangeStream:
+    """按块读取文件的[start, end]区间；读完、客户端断开（迭代器被丢弃）或尚未开始发送就被丢弃时都释放引用"""
+
+    def __init__(self, path, start, end, release):
+        self._release = None
+        self._file = open(path, "rb")
+        self._file.seek(start)
+        self._remaining = end - start + 1
+        self._release = release
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self._file.read(min(DOWNLOAD_CHUNK_SIZE, self._remaining)) if self._remaining > 0 else b""
+        if not data:
+            self.close()
+            raise StopIteration
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        if self._release is not None:
+            self._file.close()
+            self._release, release = None, self._release
+            release()
+
+    __del__ = close
+
+
+def build_app(demo=None):
+    """FastAPI应用：根路径挂载Gradio界面，另提供/download/{任务ID}（Range分段下载，大文件边读边发；
+    边渲染边输出的任务渲染中即可下载，按请求时已写入的长度返回）"""
+    import gradio as gr
+    from fastapi import FastAPI, HTTPException, Request
+    from fastapi.responses import Response, StreamingResponse
+
+    app = FastAPI()
+
+    @app.api_route("/download/{job_id}", methods=["GET", "HEAD"])
+    def download(job_id: str, request: Request):
+        try:
+            path = render_jobs.result(job_id, partial=True)
+        except (KeyError, RuntimeError) as e:
+            raise HTTPException(status_code=404, detail=e.args[0] if e.args else str(e))
+        artifact_store.pin(path)  # 下载期间不被清理，发送完（或断开）后释放
+        try:
+            size = os.path.getsize(path)
+            byte_range = parse_range_header(request.headers.get("range"), size)
+        except ValueError:
+            artifact_store.unpin(path)
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        except OSError:
+            artifact_store.unpin(path)
+            raise HTTPException(status_code=404, detail="❌ 视频文件已被清理，请重新生成！")
+        artifact_store.touch(path)
+        start, end = byte_range or (0, size - 1)
+        headers = {"Accept-Ranges": "bytes", "Content-Length": str(end - start + 1),
+                   "Content-Disposition": f'attachment; filename="mv_{job_id}.mp4"'}
+        if byte_range:
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        status_code = 206 if byte_range else 200
+        if request.method == "HEAD" or size == 0:
+            artifact_store.unpin(path)
+            return Response(status_code=status_code, headers=headers, media_type="video/mp4")
+        try:
+            stream = FileRangeStream(path, start, end, lambda: artifact_store.unpin(path))
+        except OSError:
+            artifact_store.unpin(path)
+            raise HTTPException(status_code=404, detail="❌ 视频文件已被清理，请重新生成！")
+        return StreamingResponse(stream, status_code=status_code, headers=headers, media_type="video/mp4")
+
+    return gr.mount_gradio_app(app, demo or _cached_demo(), path="")
+
+
+# ===================== 基准测试：合成输入，分阶段计时，吞吐/峰值内存，结果可比对 =====================
+# 各档位的测试规模：音频秒数、(图片张数, 尺寸档)、字幕行数、完整渲染(音频秒数, 图片张数, 尺寸档, 字幕行数)
+BENCH_PROFILES = {
+    "quick": {
+        "audio": [30, 120],
+        "images": [(1, "small"), (20, "hd")],
+        "subtitles": [10, 100],
+        "render": [(30, 5, "hd", 20)],
+    },
+    "full": {
+        "audio": [30, 300, 1800, 3600],
+        "images": [(1, "small"), (50, "hd"), (200, "hd"), (5, "48mp")],
+        "subtitles": [10, 100, 1000],
+        "render": [(30, 5, "hd", 20), (300, 50, "hd", 200), (60, 5, "48mp", 1000)],
+    },
+}
+BENCH_IMAGE_SIZES = {"small": (640, 480), "hd": (1920, 1080), "48mp": (8000, 6000)}
+
+
+def _bench_audio(path, seconds, sr=44100):
+    """合成测试音频：220Hz人声节奏（1.5秒发声/0.7秒停顿）+ 底噪，分块写WAV，固定随机种子"""
+    import wave
+    rng = np.random.default_rng(seconds)
+    total = int(seconds * sr)
+    with wave.open(path, "wb") as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(sr)
+        for start in range(0, total, sr * 10):
+            t = np.arange(start, min(total, start + sr * 10)) / sr
+            voiced = (t % 2.2) < 1.5
+            y = 0.3 * np.sin(2 * np.pi * 220 * t) * voiced + 0.003 * rng.standard_normal(len(t))
+            pcm = (np.clip(y, -1, 1) * 32767).astype(np.int16)
+            w.writeframes(np.repeat(pcm[:, None], 2, axis=1).tobytes())
+    return path
+
+
+def _bench_image(path, size, seed):
+    """合成测试背景图：渐变+噪声（JPEG压缩率接近真实照片）"""
+    w, h = size
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 256, 3)
+    gx = np.linspace(0, 255, w, dtype=np.float32)[None, :, None]
+    gy = np.linspace(0, 255, h, dtype=np.float32)[:, None, None]
+    img = (gx * 0.5 + gy * 0.3 + base) % 256
+    img = img + rng.normal(0, 8, (h, w, 1)).astype(np.float32)
+    Image.fromarray(np.clip(img, 0, 255).astype(np.uint8)).save(path, quality=90)
+    return path
+
+
+def _bench_subtitles(n_lines, duration):
+    """合成标准格式字幕：n行均匀铺满时长"""
+    step = duration / max(1, n_lines)
+    return "\n".join(f"{i * step:.2f},第{i + 1}句 benchmark line {i + 1},{(i + 1) * step:.2f},36,#FFFFFF,center,bottom100"
+                     for i in range(n_lines))
+
+
+def _bench_warmup(stage):
+    """预先导入依赖，计时只包含阶段本身"""
+    if stage == "detect":
+        import librosa
+        librosa.feature.rms(y=np.zeros(4096, dtype=np.float32))
+    elif stage == "render":
+        _ffmpeg_exe()
+
+
+def _bench_case(stage, params, inputs, work_dir):
+    """在独立进程中执行一个测试用例（峰值内存互不干扰），返回计时结果"""
+    os.chdir(work_dir)  # 临时目录与缓存都落在测试目录内，保证冷启动
+    _bench_warmup(stage)
+    t0 = time.perf_counter()
+    if stage == "detect":
+        _, segments = detect_voice_segments(inputs["audio"])
+        work, unit, extra = params["seconds"], "音频秒/秒", {"segments": len(segments)}
+    elif stage == "text":
+        _render_text_sprite.cache_clear()
+        lines = _bench_subtitles(params["lines"], 60.0).split("\n")
+        for line in lines:
+            create_text_sprite(line.split(",")[1], 36, (255, 255, 255))
+        work, unit, extra = len(lines), "行/秒", {}
+    elif stage == "slideshow":
+        plan = build_render_plan(inputs["images"], params["count"] * 3.0, 3.0, canvas="1080x1920")
+        for idx in range(len(plan.slides)):
+            plan.base_frame(idx)
+        w, h = BENCH_IMAGE_SIZES[params["size"]]
+        work, unit, extra = params["count"], "张/秒", {"megapixels": round(params["count"] * w * h / 1e6, 1)}
+    elif stage == "render":
+        mp3_images_to_mp4(inputs["audio"], inputs["images"], 3.0, "Benchmark", 30, "#FFFFFF", "center,80",
+                          subtitle_text=_bench_subtitles(params["lines"], params["seconds"]), canvas="1080x1920")
+        work, unit, extra = params["seconds"], "视频秒/秒", {}
+    else:
+        raise ValueError(f"未知测试阶段：{stage}")
+    seconds = time.perf_counter() - t0
+    peak, child_peak = _peak_rss_mb()
+    return {"stage": stage, "params": params, "seconds": round(seconds, 4),
+            "throughput": round(work / seconds, 3) if seconds > 0 else None, "unit": unit,
+            "peak_rss_mb": peak, "child_peak_rss_mb": child_peak, **extra}
+
+
+def run_benchmarks(profile="quick", output_path="bench_results.json", stages=None):
+    """生成合成输入并逐阶段计时，结果写入JSON（含运行环境信息，便于跨版本比对）"""
+    import multiprocessing
+    import platform
+    spec = BENCH_PROFILES[profile]
+    stages = stages or ["detect", "text", "slideshow", "render"]
+    work_dir = tempfile.mkdtemp(prefix="mv_bench_")
+    ctx = multiprocessing.get_context("spawn")
+    cases = []
+    try:
+        inputs_dir = ensure_dir(os.path.join(work_dir, "inputs"))
+
+        def audio(seconds):
+            path = os.path.join(inputs_dir, f"audio_{seconds}s.wav")
+            return path if os.path.exists(path) else _bench_audio(path, seconds)
+
+        def images(count, size):
+            return [p if os.path.exists(p) else _bench_image(p, BENCH_IMAGE_SIZES[size], i)
+                    for i, p in enumerate(os.path.join(inputs_dir, f"img_{size}_{i}.jpg") for i in range(count))]
+
+        if "detect" in stages:
+            cases += [("detect", {"seconds": sec}, {"audio": audio(sec)}) for sec in spec["audio"]]
+        if "text" in stages:
+            cases += [("text", {"lines": n}, {}) for n in spec["subtitles"]]
+        if "slideshow" in stages:
+            cases += [("slideshow", {"count": n, "size": size}, {"images": images(n, size)})
+                      for n, size in spec["images"]]
+        if "render" in stages:
+            cases += [("render", {"seconds": sec, "count": n, "size": size, "lines": lines},
+                       {"audio": audio(sec), "images": images(n, size)})
+                      for sec, n, size, lines in spec["render"]]
+
+        results = []
+        for stage, params, inputs in cases:
+            case_dir = tempfile.mkdtemp(prefix=f"{stage}_", dir=work_dir)
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                result = pool.submit(_bench_case, stage, params, inputs, case_dir).result()
+            results.append(result)
+            print(f"⏱️ {stage:<9} {json.dumps(params, ensure_ascii=False):<52} {result['seconds']:>9.3f}秒 "
+                  f"{result['throughput']} {result['unit']}  峰值内存{result['peak_rss_mb'] or '-'}MB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "meta": {"profile": profile, "time": time.strftime("%Y-%m-%d %H:%M:%S"), "python": sys.version.split()[0],
+                 "platform": platform.platform(), "cpu_count": os.cpu_count(), "numpy": np.__version__},
+        "results": results,
+    }
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+def compare_benchmarks(old_path, new_path, tolerance=0.10):
+    """比对两次基准结果，耗时增加超过tolerance记为退化，返回(是否无退化, 对比文本)"""
+    def load(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return {(r["stage"], json.dumps(r["params"], sort_keys=True)): r for r in json.load(f)["results"]}
+    old, new = load(old_path), load(new_path)
+    ok = True
+    lines = []
+    for key in sorted(set(old) & set(new)):
+        ratio = new[key]["seconds"] / old[key]["seconds"] if old[key]["seconds"] else float("inf")
+        regressed = ratio > 1 + tolerance
+        ok = ok and not regressed
+        lines.append(f"{'❌' if regressed else '✅'} {key[0]:<9} {key[1]:<52} "
+                     f"{old[key]['seconds']:.3f}秒 → {new[key]['seconds']:.3f}秒（×{ratio:.2f}）")
+    for key in sorted(set(old) ^ set(new)):
+        lines.append(f"⚠️ 仅一侧存在：{key[0]} {key[1]}")
+    return ok, "\n".join(lines)
+
+
+# ===================== 冷启动检查：导入耗时预算 + 重量级依赖不提前加载 =====================
+def check_import_time(budget=1.0):
+    """在全新子进程中计时导入本模块，超出预算或提前加载了重量级依赖即不通过，返回(是否通过, 提示)"""
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    module_name = os.path.splitext(os.path.basename(__file__))[0]
+    code = (f"import json, sys, time; t = time.perf_counter(); import {module_name}; "
+            f"print(json.dumps([time.perf_counter() - t, [m for m in {HEAVY_MODULES!r} if m in sys.modules]]))")
+    proc = subprocess.run([sys.executable, "-c", code], cwd=module_dir, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return False, f"❌ 导入失败：{proc.stderr.strip()[-500:]}"
+    elapsed, loaded = json.loads(proc.stdout.strip().splitlines()[-1])
+    passed = elapsed <= budget and not loaded
+    tip = f"{'✅' if passed else '❌'} 导入耗时{elapsed:.3f}秒（预算{budget}秒）"
+    if loaded:
+        tip += f"，提前加载了：{', '.join(loaded)}"
+    return passed, tip
+
+
+# ===================== 启动应用 + 自动清理 + 依赖安装 =====================
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="MV-Maker：不带参数启动Web界面；batch子命令按JSONL清单批量生成")
+    subparsers = parser.add_subparsers(dest="command")
+    batch_parser = subparsers.add_parser("batch", help="无界面批量生成MV")
+    batch_parser.add_argument("manifest", help="JSONL清单，每行一个MV任务")
+    batch_parser.add_argument("-o", "--results", default="batch_results.jsonl", help="结果清单输出路径")
+    batch_parser.add_argument("-j", "--jobs", type=int, default=None, help="并行任务数（默认CPU核数）")
+    batch_parser.add_argument("--out-dir", default=None, help="MP4输出目录（默认清单目录下batch_output）")
+    detect_parser = subparsers.add_parser("detect", help="批量检测多个音频的语音段（进程池并行）")
+    detect_parser.add_argument("audio", nargs="+", help="音频文件")
+    detect_parser.add_argument("-t", "--threshold", type=float, default=0.02, help="语音检测阈值")
+    detect_parser.add_argument("--min-duration", type=float, default=0.3, help="最短语音段时长（秒）")
+    detect_parser.add_argument("-j", "--jobs", type=int, default=None, help="并行进程数（默认CPU核数）")
+    detect_parser.add_argument("-o", "--output", default=None, help="结果JSONL输出路径（每完成一个文件写一行）")
+    check_parser = subparsers.add_parser("check-import", help="检查模块冷启动导入耗时")
+    check_parser.add_argument("--budget", type=float, default=1.0, help="导入耗时预算（秒）")
+    bench_parser = subparsers.add_parser("bench", help="各阶段基准测试（合成输入，离线运行）")
+    bench_parser.add_argument("--profile", choices=list(BENCH_PROFILES.keys()), default="quick", help="测试规模")
+    bench_parser.add_argument("--stages", nargs="+", choices=["detect", "text", "slideshow", "render"],
+                              default=None, help="只测指定阶段")
+    bench_parser.add_argument("-o", "--output", default="bench_results.json", help="结果JSON输出路径")
+    bench_parser.add_argument("--compare", default=None, help="与之前的结果JSON比对，有退化时返回非0")
+    bench_parser.add_argument("--tolerance", type=float, default=0.10, help="允许的耗时增幅（默认10%%）")
+    calibrate_parser = subparsers.add_parser("calibrate", help="实测本机x264编码吞吐，供编码档位自动调优")
+    calibrate_parser.add_argument("-o", "--output", default=ENCODER_CALIBRATION_PATH, help="校准结果JSON输出路径")
+    calibrate_parser.add_argument("--size", default="1280x720", help="校准画面尺寸（宽x高）")
+    cli_args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    if cli_args.command == "bench":
+        run_benchmarks(cli_args.profile, cli_args.output, cli_args.stages)
+        if cli_args.compare:
+            compare_ok, compare_text = compare_benchmarks(cli_args.compare, cli_args.output, cli_args.tolerance)
+            print(compare_text)
+            sys.exit(0 if compare_ok else 1)
+        sys.exit(0)
+    if cli_args.command == "calibrate":
+        calibration_result = calibrate_encoder(size=parse_canvas(cli_args.size) or (1280, 720),
+                                               output_path=cli_args.output)
+        for row in calibration_result["results"]:
+            print(f"preset={row['preset']:<10} threads={row['threads']:<3} {row['fps']}帧/秒")
+        print(f"✅ 校准完成，结果已保存：{cli_args.output}")
+        sys.exit(0)
+    if cli_args.command == "check-import":
+        check_passed, check_tip = check_import_time(cli_args.budget)
+        print(check_tip)
+        sys.exit(0 if check_passed else 1)
+    if cli_args.command == "detect":
+        ok_count = fail_count = 0
+        with (open(cli_args.output, "w", encoding="utf-8") if cli_args.output
+              else contextlib.nullcontext()) as detect_out:
+            for detect_result in detect_voice_segments_batch(cli_args.audio, cli_args.threshold,
+                                                             cli_args.min_duration, cli_args.jobs):
+                ok_count += detect_result["status"] == "done"
+                fail_count += detect_result["status"] != "done"
+                if detect_out:
+                    detect_out.write(json.dumps(detect_result, ensure_ascii=False) + "\n")
+                    detect_out.flush()
+                print(f"{'✅' if detect_result['status'] == 'done' else '❌'} {detect_result['path']}"
+                      f"（{detect_result['seconds']}秒）"
+                      f"{detect_result['error'] or str(len(detect_result['segments'])) + '个语音段'}")
+        print(f"✅ 批量检测完成：成功{ok_count}个，失败{fail_count}个")
+        sys.exit(1 if fail_count else 0)
+    if cli_args.command == "batch":
+        ok_count, fail_count = run_batch(cli_args.manifest, cli_args.results, cli_args.jobs, cli_args.out_dir)
+        print(f"✅ 批量完成：成功{ok_count}个，失败{fail_count}个，结果清单：{cli_args.results}")
+        sys.exit(1 if fail_count else 0)
+
+    # 自动安装缺失依赖（清华源加速，解决下载慢/失败）
+    required_pkgs = ["gradio", "moviepy", "pillow", "librosa", "numpy"]
+    for pkg in required_pkgs:
+        try:
+            __import__(pkg)
+        except ImportError:
+            print(f"正在安装缺失依赖：{pkg}")
+            os.system(f"pip install {pkg} -i https://pypi.tuna.tsinghua.edu.cn/simple")
+
+    # 程序退出时自动清理临时文件，避免占用磁盘；缓存目录保留到下次启动复用（须在启动服务前注册：服务会一直阻塞到退出）
+    def cleanup_temp_files():
+        artifact_store.stop()
+        for dir_name in TEMP_DIRS:
+            if os.path.exists(dir_name):
+                try:
+                    shutil.rmtree(dir_name)
+                    print(f"✅ 已清理临时目录：{dir_name}")
+                except Exception as e:
+                    print(f"⚠️  清理临时目录失败：{e}")
+
+
+    import atexit
+
+    atexit.register(cleanup_temp_files)
+
+    # 构建界面并启动服务（本地访问，端口7860；运行期间后台按配额/过期时间清理临时文件）
+    ensure_dir(os.environ['GRADIO_TEMP_DIR'])
+    artifact_store.start()
+    app = build_app(build_demo())
+    print("✅ 服务启动成功，浏览器访问：http://localhost:7860")
+    import uvicorn
 
-    atexit.register(cleanup_temp_files)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=7860)
\ No newline at end of file